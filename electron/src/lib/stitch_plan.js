@@ -0,0 +1,137 @@
+/*
+ * Authors: see git history
+ *
+ * Copyright (c) 2010 Authors
+ * Licensed under the GNU GPL version 3.0 or later.  See the file LICENSE for details.
+ *
+ */
+
+import { inkStitch } from './api.js'
+
+// These must match the flags in lib/api/stitch_plan.py
+export const STITCH_JUMP = 1
+export const STITCH_TRIM = 2
+export const STITCH_STOP = 4
+export const STITCH_COLOR_CHANGE = 8
+
+// Decode the binary stitch plan sent by /stitch_plan/binary and, one color
+// block at a time, by /stitch_plan/stream.  See get_stitch_plan_binary() in
+// lib/api/stitch_plan.py for the format.
+//
+// Instead of a list of stitches, each color block gets x, y and commands:
+// typed arrays that are views on its part of the response.
+export function decodeStitchPlan(buffer) {
+  let view = new DataView(buffer)
+  let headerLength = view.getUint32(0, true)
+  let stitchPlan = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength)))
+
+  let numStitches = stitchPlan.num_stitches
+  let offset = 4 + headerLength
+  let x = new Float32Array(buffer, offset, numStitches)
+  let y = new Float32Array(buffer, offset + 4 * numStitches, numStitches)
+  let commands = new Uint8Array(buffer, offset + 8 * numStitches, numStitches)
+
+  let start = 0
+  stitchPlan.color_blocks.forEach(color_block => {
+    let end = start + color_block.num_stitches
+    color_block.x = x.subarray(start, end)
+    color_block.y = y.subarray(start, end)
+    color_block.commands = commands.subarray(start, end)
+    start = end
+  })
+
+  return stitchPlan
+}
+
+// The stitches of several color blocks, numbered from 0 across all of them.
+// The stitches stay in the color blocks' typed arrays.
+export class StitchList {
+  constructor() {
+    this.colorBlocks = []
+    this.starts = []
+    this.length = 0
+  }
+
+  addColorBlock(color_block) {
+    this.colorBlocks.push(color_block)
+    this.starts.push(this.length)
+    this.length += color_block.num_stitches
+  }
+
+  // Find the color block that stitch i is in and the stitch's index in it.
+  locate(i) {
+    // the last color block that starts at or before i
+    let low = 0
+    let high = this.starts.length - 1
+    while (low < high) {
+      let middle = (low + high + 1) >> 1
+      if (this.starts[middle] <= i) {
+        low = middle
+      } else {
+        high = middle - 1
+      }
+    }
+
+    return [this.colorBlocks[low], i - this.starts[low]]
+  }
+
+  x(i) {
+    let [color_block, j] = this.locate(i)
+    return color_block.x[j]
+  }
+
+  y(i) {
+    let [color_block, j] = this.locate(i)
+    return color_block.y[j]
+  }
+
+  commands(i) {
+    let [color_block, j] = this.locate(i)
+    return color_block.commands[j]
+  }
+
+  isJump(i) {
+    return (this.commands(i) & STITCH_JUMP) !== 0
+  }
+
+  isTrim(i) {
+    return (this.commands(i) & STITCH_TRIM) !== 0
+  }
+
+  isStop(i) {
+    return (this.commands(i) & STITCH_STOP) !== 0
+  }
+
+  isColorChange(i) {
+    return (this.commands(i) & STITCH_COLOR_CHANGE) !== 0
+  }
+}
+
+// Receive the stitch plan one color block at a time while it is generated.
+// onColorBlock is called with each color block as it arrives, with its
+// stitches in typed arrays (see decodeStitchPlan()).  Resolves to the
+// summary of the stitch plan (bounding_box, num_stitches, etc) once all color
+// blocks have been sent.
+export function streamStitchPlan(onColorBlock) {
+  return new Promise((resolve, reject) => {
+    let source = new EventSource(`${inkStitch.defaults.baseURL}/stitch_plan/stream`)
+
+    source.addEventListener('color_block', event => {
+      let binary = Uint8Array.from(atob(JSON.parse(event.data)), c => c.charCodeAt(0))
+      onColorBlock(decodeStitchPlan(binary.buffer).color_blocks[0])
+    })
+    source.addEventListener('end', event => {
+      source.close()
+      resolve(JSON.parse(event.data))
+    })
+    source.addEventListener('error', event => {
+      source.close()
+      if (event.data) {
+        // Stitch plan generation had an error.
+        reject(JSON.parse(event.data))
+      } else {
+        reject({error_message: "Stitch plan generation failed."})
+      }
+    })
+  })
+}
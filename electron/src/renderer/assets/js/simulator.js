@@ -6,6 +6,7 @@
  *
  */
 import { inkStitch } from '../../../lib/api.js'
+import { STITCH_COLOR_CHANGE, STITCH_JUMP, STITCH_TRIM, StitchList, streamStitchPlan } from '../../../lib/stitch_plan.js'
 
 import { SVG } from '@svgdotjs/svg.js'
 import '@svgdotjs/svg.panzoom.js'
@@ -95,7 +96,7 @@ export default {
         }
 
         setImmediate(()=> {
-          for (let i = 1; i < this.stitches.length; i++) {
+          for (let i = 1; i <= this.numStitches; i++) {
             if (i < this.currentStitch) {
               this.realisticPaths[i].show()
             } else {
@@ -109,7 +110,7 @@ export default {
 
       } else {
 
-        for (let i = 1; i < this.stitches.length; i++) {
+        for (let i = 1; i <= this.numStitches; i++) {
           if (i < this.currentStitch) {
             this.stitchPaths[i].show()
           } else {
@@ -138,24 +139,25 @@ export default {
       return this.speed * this.direction
     },
     currentCommand() {
-      let stitch = this.stitches[Math.floor(this.currentStitch)]
+      let stitch = Math.floor(this.currentStitch)
 
-      if (stitch === undefined || stitch === null) {
+      if (stitch < 1 || stitch > this.numStitches || stitch > this.stitches.length) {
         return ""
       }
 
+      // stitches are numbered from 1, but StitchList counts from 0
       let label = this.$gettext("STITCH")
       switch (true) {
-        case stitch.jump:
+        case this.stitches.isJump(stitch - 1):
           label = this.$gettext("JUMP")
           break
-        case stitch.trim:
+        case this.stitches.isTrim(stitch - 1):
           label = this.$gettext("TRIM")
           break
-        case stitch.stop:
+        case this.stitches.isStop(stitch - 1):
           label = this.$gettext("STOP")
           break
-        case stitch.color_change:
+        case this.stitches.isColorChange(stitch - 1):
           label = this.$gettext("COLOR CHANGE")
           break
       }
@@ -174,6 +176,12 @@ export default {
     sliderMarks() {
       var marks = {}
 
+      // numStitches changes whenever a color block arrives, and with it the
+      // marks
+      if (this.numStitches < 1) {
+        return marks
+      }
+
       if (this.showTrims)
         Object.assign(marks, this.trimMarks);
 
@@ -229,7 +237,7 @@ export default {
     animationNextCommand() {
       let nextCommandIndex = this.getNextCommandIndex()
       if (nextCommandIndex === -1) {
-        this.setCurrentStitch(this.stitches.length)
+        this.setCurrentStitch(this.numStitches)
       } else {
         this.setCurrentStitch(this.commandList[nextCommandIndex])
       }
@@ -296,12 +304,17 @@ export default {
       } else {
         this.timer = null;
         this.stop()
+
+        if (this.streaming && this.direction > 0) {
+          // keep going once the next color block arrives
+          this.waitingForStitches = true
+        }
       }
     },
     renderFrame() {
       while (this.renderedStitch < this.currentStitch) {
         this.renderedStitch += 1
-        if (!this.renderJumps && this.stitches[this.renderedStitch].jump){
+        if (!this.renderJumps && this.stitches.isJump(this.renderedStitch - 1)){
           if (this.showRealisticPreview) {
               this.realisticPaths[this.renderedStitch].hide();
           } else {
@@ -343,6 +356,8 @@ export default {
       }
     },
     stop() {
+      this.waitingForStitches = false
+
       if (this.animating) {
         if (this.timer) {
           clearTimeout(this.timer)
@@ -365,12 +380,12 @@ export default {
       this.adjustScale()
     },
     moveCursor() {
-      let stitch = this.stitches[Math.floor(this.currentStitch)]
-      if (stitch === null || stitch === undefined) {
+      let stitch = Math.floor(this.currentStitch)
+      if (stitch < 1 || stitch > this.numStitches || stitch > this.stitches.length) {
         this.cursor.hide()
       } else if (this.showCursor) {
         this.cursor.show()
-        this.cursor.center(stitch.x, stitch.y)
+        this.cursor.center(this.stitches.x(stitch - 1), this.stitches.y(stitch - 1))
       }
     },
     adjustScale: throttle(function () {
@@ -396,33 +411,94 @@ export default {
         this.scaleLabel.text(`${mm} mm`)
       }, 100, {leading: true, trailing: true}
     ),
-    generateMarks() {
-      this.commandList = Array()
-      for (let i = 1; i < this.stitches.length; i++) {
-        if (this.stitches[i].trim) {
+    addColorBlock(color_block) {
+      let color = `${color_block.color.visible_on_white.hex}`
+      let path_attrs = {fill: "none", stroke: color, "stroke-width": 0.3}
+      let marker = this.generateMarker(color)
+
+      // The stitch plan's bounding box is only sent after the last color
+      // block, so we keep track of it ourselves.
+      let [minx, miny, maxx, maxy] = this.boundingBox
+
+      let {x, y, commands} = color_block
+      let stitching = false
+      for (let i = 0; i < color_block.num_stitches; i++) {
+        let path = null
+        if (stitching && i > 0) {
+          path = this.simulation.path(`M${x[i - 1]},${y[i - 1]} ${x[i]},${y[i]}`).attr(path_attrs).hide()
+        } else {
+          path = this.simulation.path(`M${x[i]},${y[i]} ${x[i]},${y[i]}`).attr(path_attrs).hide()
+        }
+        path.marker('end', marker)
+        this.stitchPaths.push(path)
+
+        if (commands[i] & (STITCH_TRIM | STITCH_COLOR_CHANGE)) {
+          stitching = false
+        } else if (!(commands[i] & STITCH_JUMP)) {
+          stitching = true
+        }
+
+        minx = Math.min(minx, x[i])
+        miny = Math.min(miny, y[i])
+        maxx = Math.max(maxx, x[i])
+        maxy = Math.max(maxy, y[i])
+      }
+      this.boundingBox = [minx, miny, maxx, maxy]
+
+      let first = this.stitches.length + 1
+      this.stitches.addColorBlock(color_block)
+      this.numStitches = this.stitches.length
+      this.generateMarks(first, this.numStitches)
+      this.generateColorSections()
+
+      if (this.realisticPreview !== null) {
+        this.addRealisticPaths(color_block)
+      }
+
+      if (!this.userZoomed) {
+        this.zoomDesign()
+      }
+
+      if (first === 1) {
+        // the first color block: start the simulation while the rest of the
+        // stitch plan is generated
+        this.loading = false
+        this.start()
+      } else if (this.waitingForStitches) {
+        this.start()
+      }
+    },
+    generateMarks(first, last) {
+      // stitches first through last, numbered from 1
+      for (let i = first; i <= last; i++) {
+        if (this.stitches.isTrim(i - 1)) {
           this.trimMarks[i] = new SliderMark("trim", "cut")
           this.commandList.push(i)
-        } else if (this.stitches[i].stop) {
+        } else if (this.stitches.isStop(i - 1)) {
           this.stopMarks[i] = new SliderMark("stop", "pause")
           this.commandList.push(i)
-        } else if (this.stitches[i].jump) {
+        } else if (this.stitches.isJump(i - 1)) {
           this.jumpMarks[i] = new SliderMark("jump", "frog")
           this.commandList.push(i)
-        } else if (this.stitches[i].color_change) {
+        } else if (this.stitches.isColorChange(i - 1)) {
           this.colorChangeMarks[i] = new SliderMark("color-change", "exchange-alt")
           this.commandList.push(i)
         }
       }
     },
     generateColorSections() {
+      // the sections are relative to numStitches, so they're all recalculated
+      // when a color block arrives
+      this.sliderColorSections.length = 0
+
       var currentStitch = 0
-      this.stitchPlan.color_blocks.forEach(color_block => {
+      this.stitches.colorBlocks.forEach(color_block => {
         this.sliderColorSections.push([
           (currentStitch + 1) / this.numStitches * 100,
-          (currentStitch + color_block.stitches.length) / this.numStitches * 100,
+          (currentStitch + color_block.num_stitches) / this.numStitches * 100,
           {backgroundColor: color_block.color.visible_on_white.hex}
         ])
-        currentStitch += color_block.stitches.length
+        currentStitch += color_block.num_stitches
       })
     },
     generateMarker(color) {
@@ -472,60 +548,58 @@ export default {
       // Create realistic paths in it's own group and move it behind the cursor
       this.realisticPreview = this.svg.group({id: 'realistic'}).backward()
 
-      this.stitchPlan.color_blocks.forEach(color_block => {
-        let color = `${color_block.color.visible_on_white.hex}`
-        let realistic_path_attrs = {fill: color, stroke: "none", filter: this.filter}
+      this.stitches.colorBlocks.forEach(color_block => this.addRealisticPaths(color_block))
+    },
+    addRealisticPaths(color_block) {
+      let color = `${color_block.color.visible_on_white.hex}`
+      let realistic_path_attrs = {fill: color, stroke: "none", filter: this.filter}
 
-        let stitching = false
-        let prevStitch = null
-        color_block.stitches.forEach(stitch => {
+      let {x, y, commands} = color_block
+      let stitching = false
+      for (let i = 0; i < color_block.num_stitches; i++) {
 
-          let realisticPath = null
-          if (stitching && prevStitch) {
+        let realisticPath = null
+        if (stitching && i > 0) {
 
-            // Position
-            let stitch_center = []
-            stitch_center.x = (prevStitch.x + stitch.x) / 2.0
-            stitch_center.y = (prevStitch.y + stitch.y) / 2.0
+          // Position
+          let stitch_center = []
+          stitch_center.x = (x[i - 1] + x[i]) / 2.0
+          stitch_center.y = (y[i - 1] + y[i]) / 2.0
 
-            // Angle
-            var stitch_angle = Math.atan2(stitch.y - prevStitch.y, stitch.x - prevStitch.x) * (180 / Math.PI)
+          // Angle
+          var stitch_angle = Math.atan2(y[i] - y[i - 1], x[i] - x[i - 1]) * (180 / Math.PI)
 
-            // Length
-            let path_length = Math.hypot(stitch.x - prevStitch.x, stitch.y - prevStitch.y)
+          // Length
+          let path_length = Math.hypot(x[i] - x[i - 1], y[i] - y[i - 1])
 
-            var path = `M0,0 c 0.4,0,0.4,0.3,0.4,0.6 c 0,0.3,-0.1,0.6,-0.4,0.6 v 0.2,-0.2 h -${path_length} c -0.4,0,-0.4,-0.3,-0.4,-0.6 c 0,-0.3,0.1,-0.6,0.4,-0.6 v -0.2,0.2 z`
-            path = svgpath(path).rotate(stitch_angle).toString()
+          var path = `M0,0 c 0.4,0,0.4,0.3,0.4,0.6 c 0,0.3,-0.1,0.6,-0.4,0.6 v 0.2,-0.2 h -${path_length} c -0.4,0,-0.4,-0.3,-0.4,-0.6 c 0,-0.3,0.1,-0.6,0.4,-0.6 v -0.2,0.2 z`
+          path = svgpath(path).rotate(stitch_angle).toString()
 
-            realisticPath = this.realisticPreview.path(path).attr(realistic_path_attrs).center(stitch_center.x, stitch_center.y).hide()
+          realisticPath = this.realisticPreview.path(path).attr(realistic_path_attrs).center(stitch_center.x, stitch_center.y).hide()
 
-          } else {
-            realisticPath = this.realisticPreview.rect(0, 1).attr(realistic_path_attrs).center(stitch.x, stitch.y).hide()
-          }
+        } else {
+          realisticPath = this.realisticPreview.rect(0, 1).attr(realistic_path_attrs).center(x[i], y[i]).hide()
+        }
 
-          this.realisticPaths.push(realisticPath)
+        this.realisticPaths.push(realisticPath)
 
-          if (stitch.trim || stitch.color_change) {
-            stitching = false
-          } else if (!stitch.jump) {
-            stitching = true
-          }
-          prevStitch = stitch
-        })
-      })
+        if (commands[i] & (STITCH_TRIM | STITCH_COLOR_CHANGE)) {
+          stitching = false
+        } else if (!(commands[i] & STITCH_JUMP)) {
+          stitching = true
+        }
+      }
     },
     generatePage () {
       this.$refs.simulator.style.backgroundColor = this.page_specs.deskcolor
 
       let page = this.svg.rect(this.page_specs.width, this.page_specs.height)
-      .move(-this.stitchPlan.bounding_box[0],-this.stitchPlan.bounding_box[1])
       .fill(this.page_specs.pagecolor)
       .stroke({width: 0.1, color: this.page_specs.bordercolor})
       .back()
 
       if (this.page_specs.showpageshadow === "true") {
         let shadow = this.svg.rect(this.page_specs.width, this.page_specs.height)
-        .move(-this.stitchPlan.bounding_box[0],-this.stitchPlan.bounding_box[1])
         .fill(this.page_specs.bordercolor)
         .filterWith(add => {
             let blur = add.offset(.5,.5).in(add.$source).gaussianBlur(.5)
@@ -536,13 +610,18 @@ export default {
       this.page_specs["bbox"] = page.bbox()
     },
     zoomDesign () {
-      let [minx, miny, maxx, maxy] = this.stitchPlan.bounding_box
+      if (this.stitches.length === 0) {
+        return
+      }
+
+      let [minx, miny, maxx, maxy] = this.boundingBox
       let designWidth = maxx - minx
       let designHeight = maxy - miny
-      this.svg.viewbox(0, 0, designWidth, designHeight);
+      this.svg.viewbox(minx, miny, designWidth, designHeight);
       this.resizeCursor()
     },
     zoomPage () {
+      this.userZoomed = true
       this.svg.viewbox(this.page_specs.bbox.x, this.page_specs.bbox.y - 50, this.page_specs.bbox.width + 100, this.page_specs.bbox.height + 100)
       this.resizeCursor()
     },
@@ -558,7 +637,12 @@ export default {
     this.lastFrameStart = null
     this.stitchPaths = [null]  // 1-indexed to match up with stitch number display
     this.realisticPaths = [null]
-    this.stitches = [null]
+    this.stitches = new StitchList()
+    this.boundingBox = [Infinity, Infinity, -Infinity, -Infinity]
+    this.commandList = []
+    this.streaming = true
+    this.waitingForStitches = false
+    this.userZoomed = false
     this.svg = null
     this.simulation = null
     this.realisticPreview = null
@@ -577,88 +661,45 @@ export default {
     this.svg.node.classList.add('simulation')
     this.simulation = this.svg.group({id: 'line'})
 
-    this.loading = true
-
-    inkStitch.get('stitch_plan').then(response => {
-      this.stitchPlan = response.data
-      let [minx, miny, maxx, maxy] = this.stitchPlan.bounding_box
-      let width = maxx - minx
-      let height = maxy - miny
-      this.svg.viewbox(0, 0, width, height);
-
-      this.stitchPlan.color_blocks.forEach(color_block => {
-        let color = `${color_block.color.visible_on_white.hex}`
-        let path_attrs = {fill: "none", stroke: color, "stroke-width": 0.3}
-        let marker = this.generateMarker(color)
-
-        let stitching = false
-        let prevStitch = null
-        color_block.stitches.forEach(stitch => {
-          stitch.x -= minx
-          stitch.y -= miny
-
-          let path = null
-          if (stitching && prevStitch) {
-            path = this.simulation.path(`M${prevStitch.x},${prevStitch.y} ${stitch.x},${stitch.y}`).attr(path_attrs).hide()
-          } else {
-            path = this.simulation.path(`M${stitch.x},${stitch.y} ${stitch.x},${stitch.y}`).attr(path_attrs).hide()
-          }
-          path.marker('end', marker)
-          this.stitchPaths.push(path)
-          this.stitches.push(stitch)
-
-          if (stitch.trim || stitch.color_change) {
-            stitching = false
-          } else if (!stitch.jump) {
-            stitching = true
-          }
-
-          prevStitch = stitch
-        })
-      })
+    this.generateScale()
+    this.generateCursor()
+
+    // v-on:keydown doesn't seem to work, maybe an Electron issue?
+    this.$mousetrap.bind("up", this.animationSpeedUp)
+    this.$mousetrap.bind("down", this.animationSlowDown)
+    this.$mousetrap.bind("left", this.animationReverse)
+    this.$mousetrap.bind("right", this.animationForward)
+    this.$mousetrap.bind("pagedown", this.animationPreviousCommand)
+    this.$mousetrap.bind("pageup", this.animationNextCommand)
+    this.$mousetrap.bind("space", this.toggleAnimation)
+    this.$mousetrap.bind("+", this.animationForwardOneStitch)
+    this.$mousetrap.bind("-", this.animationBackwardOneStitch)
+    this.$mousetrap.bind("]", this.zoomDesign)
+    this.$mousetrap.bind("[", this.zoomPage)
+
+    this.svg.on('zoom', this.resizeCursor)
+
+    // Zoom to the design as it grows, until the user zooms or pans.
+    this.svg.on('zoom', () => {this.userZoomed = true})
+    this.svg.on('panStart', () => {this.userZoomed = true})
+
+    inkStitch.get('page_specs').then(response => {
+      this.page_specs = response.data
+      this.generatePage()
+    })
 
-      this.numStitches = this.stitches.length - 1
-      this.generateMarks()
-      this.generateColorSections()
-      this.generateScale()
-      this.generateCursor()
-      this.resizeCursor()
+    this.loading = true
 
+    streamStitchPlan(this.addColorBlock).then(summary => {
+      this.streaming = false
+      this.waitingForStitches = false
+      this.numStitches = this.stitches.length
       this.loading = false
-
-      // v-on:keydown doesn't seem to work, maybe an Electron issue?
-      this.$mousetrap.bind("up", this.animationSpeedUp)
-      this.$mousetrap.bind("down", this.animationSlowDown)
-      this.$mousetrap.bind("left", this.animationReverse)
-      this.$mousetrap.bind("right", this.animationForward)
-      this.$mousetrap.bind("pagedown", this.animationPreviousCommand)
-      this.$mousetrap.bind("pageup", this.animationNextCommand)
-      this.$mousetrap.bind("space", this.toggleAnimation)
-      this.$mousetrap.bind("+", this.animationForwardOneStitch)
-      this.$mousetrap.bind("-", this.animationBackwardOneStitch)
-      this.$mousetrap.bind("]", this.zoomDesign)
-      this.$mousetrap.bind("[", this.zoomPage)
-
-      this.svg.on('zoom', this.resizeCursor)
-
-      inkStitch.get('page_specs').then(response => {
-        this.page_specs = response.data
-        this.generatePage()
-      })
-
-      this.start()
     }).catch(error => {
+      this.streaming = false
       this.loading = false
-      if (error.response) {
-        // Stitch plan generation had an error.  Show it to the user.
-        this.error_message = error.response.data.error_message
-      } else if (error.request) {
-        // We sent the request and didn't get a response.
-        this.error_message = "Stitch plan generation failed."
-      } else {
-        // Something weird happened in axios.
-        this.error_message = error.message
-      }
+      // Stitch plan generation had an error.  Show it to the user.
+      this.error_message = error.error_message || error.message
       this.error = true
     })
   }
@@ -101,7 +101,7 @@ if running_as_frozen or not debug_active:
 #   example:  --extension=params will instantiate Params() class from lib.extensions.
 
 # we need to import only after possible modification of sys.path, we disable here flake8 E402
-from lib import extensions  # noqa: E402  # import all supported extensions of institch
+from lib.extensions import get_extension_class  # noqa: E402  # extensions are imported on demand
 
 parser = ArgumentParser()
 parser.add_argument("--extension")
@@ -112,7 +112,7 @@ extension_name = my_args.extension
 # example: foo_bar_baz -> FooBarBaz
 extension_class_name = extension_name.title().replace("_", "")
 
-extension_class = getattr(extensions, extension_class_name)
+extension_class = get_extension_class(extension_class_name)
 extension = extension_class()  # create instance of extension class - call __init__ method
 
 # extension run(), we differentiate between debug and normal mode
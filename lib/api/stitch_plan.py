@@ -3,13 +3,110 @@
 # Copyright (c) 2010 Authors
 # Licensed under the GNU GPL version 3.0 or later.  See the file LICENSE for details.
 
-from flask import Blueprint, g, jsonify
+import struct
+from base64 import b64encode
+from threading import Lock
+
+import numpy as np
+from flask import (Blueprint, Response, current_app, g, jsonify, request,
+                   stream_with_context)
 
 from ..exceptions import InkstitchException, format_uncaught_exception
-from ..stitch_plan import stitch_groups_to_stitch_plan
+from ..stitch_plan import (StitchPlan, stitch_groups_to_color_blocks,
+                           stitch_groups_to_stitch_plan)
+from ..utils.cache import CacheKeyGenerator
 
 stitch_plan = Blueprint('stitch_plan', __name__)
 
+# command flags used by the binary stitch plan format
+STITCH_JUMP = 1
+STITCH_TRIM = 2
+STITCH_STOP = 4
+STITCH_COLOR_CHANGE = 8
+
+
+# The last stitch plan we generated and the fingerprint of the elements it
+# was generated from.  Reloading the simulator or opening the print preview
+# asks for the same stitch plan again, so there's no need to stitch it again.
+_last_stitch_plan = (None, None)
+_last_stitch_plan_lock = Lock()
+
+
+def get_stitch_plan_fingerprint(metadata):
+    """Identify the stitch plan that the current elements would produce.
+
+    The fingerprint is built from the elements' stitch plan cache keys, so it
+    changes whenever anything that affects the stitches changes.  It must be
+    called after g.extension.get_elements().
+    """
+
+    cache_key_generator = CacheKeyGenerator()
+    cache_key_generator.update((metadata['collapse_len_mm'], metadata['min_stitch_len_mm']))
+    for element in g.extension.elements:
+        cache_key_generator.update(element.get_cache_key(None))
+
+    return cache_key_generator.get_cache_key()
+
+
+def get_cached_stitch_plan(fingerprint):
+    fingerprint_of_last, stitch_plan = _last_stitch_plan
+    if fingerprint_of_last == fingerprint:
+        return stitch_plan
+    return None
+
+
+def cache_stitch_plan(fingerprint, stitch_plan):
+    global _last_stitch_plan
+
+    with _last_stitch_plan_lock:
+        _last_stitch_plan = (fingerprint, stitch_plan)
+
+
+def generate_stitch_plan(metadata):
+    collapse_len = metadata['collapse_len_mm']
+    min_stitch_len = metadata['min_stitch_len_mm']
+    patches = g.extension.elements_to_stitch_groups(g.extension.elements)
+    return stitch_groups_to_stitch_plan(patches, collapse_len=collapse_len, min_stitch_len=min_stitch_len)
+
+
+def generate_color_blocks(metadata):
+    collapse_len = metadata['collapse_len_mm']
+    min_stitch_len = metadata['min_stitch_len_mm']
+    patches = g.extension.iter_stitch_groups(g.extension.elements)
+    return stitch_groups_to_color_blocks(patches, collapse_len=collapse_len, min_stitch_len=min_stitch_len)
+
+
+def get_or_generate_stitch_plan(fingerprint, metadata):
+    stitch_plan = get_cached_stitch_plan(fingerprint)
+    if stitch_plan is None:
+        stitch_plan = generate_stitch_plan(metadata)
+        cache_stitch_plan(fingerprint, stitch_plan)
+
+    return stitch_plan
+
+
+def _not_modified(fingerprint):
+    return fingerprint in request.if_none_match
+
+
+def _conditional_response(response, fingerprint):
+    # no-cache lets the client keep the response, but makes it ask us whether
+    # it's still current (which it will do with If-None-Match)
+    response.set_etag(fingerprint)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _not_modified_response(fingerprint):
+    return _conditional_response(Response(status=304), fingerprint)
+
+
+def _error_message(exc):
+    if isinstance(exc, InkstitchException):
+        return str(exc)
+    else:
+        return format_uncaught_exception()
+
 
 @stitch_plan.route('')
 def get_stitch_plan():
@@ -18,12 +115,177 @@ def get_stitch_plan():
 
     try:
         metadata = g.extension.get_inkstitch_metadata()
-        collapse_len = metadata['collapse_len_mm']
-        min_stitch_len = metadata['min_stitch_len_mm']
-        patches = g.extension.elements_to_stitch_groups(g.extension.elements)
-        stitch_plan = stitch_groups_to_stitch_plan(patches, collapse_len=collapse_len, min_stitch_len=min_stitch_len)
-        return jsonify(stitch_plan)
-    except InkstitchException as exc:
-        return jsonify({"error_message": str(exc)}), 500
-    except Exception:
-        return jsonify({"error_message": format_uncaught_exception()}), 500
+        fingerprint = get_stitch_plan_fingerprint(metadata)
+        if _not_modified(fingerprint):
+            return _not_modified_response(fingerprint)
+
+        return _conditional_response(jsonify(get_or_generate_stitch_plan(fingerprint, metadata)), fingerprint)
+    except Exception as exc:
+        return jsonify({"error_message": _error_message(exc)}), 500
+
+
+@stitch_plan.route('/binary')
+def get_stitch_plan_binary():
+    """Send the stitch plan in a compact binary format.
+
+    Large designs have hundreds of thousands of stitches.  Sending them as one
+    JSON object per stitch makes for a huge response that is slow to encode
+    and to parse.  This format can be loaded into typed arrays directly.
+
+    The response is laid out as follows, all numbers are little-endian:
+
+      uint32                 length of the JSON header in bytes
+      JSON header            the stitch plan without its stitches, padded with
+                             spaces so that the arrays below are 4-byte aligned.
+                             Each color block has a num_stitches entry instead
+                             of a list of stitches.
+      float32[num_stitches]  x coordinates of all stitches
+      float32[num_stitches]  y coordinates of all stitches
+      uint8[num_stitches]    commands: a combination of the STITCH_* flags
+    """
+
+    if not g.extension.get_elements():
+        return Response(stitch_plan_to_binary(None), mimetype='application/octet-stream')
+
+    try:
+        metadata = g.extension.get_inkstitch_metadata()
+        fingerprint = get_stitch_plan_fingerprint(metadata)
+        if _not_modified(fingerprint):
+            return _not_modified_response(fingerprint)
+
+        stitch_plan = get_or_generate_stitch_plan(fingerprint, metadata)
+        response = Response(stitch_plan_to_binary(stitch_plan), mimetype='application/octet-stream')
+        return _conditional_response(response, fingerprint)
+    except Exception as exc:
+        return jsonify({"error_message": _error_message(exc)}), 500
+
+
+@stitch_plan.route('/stream')
+def get_stitch_plan_stream():
+    """Send the stitch plan as server-sent events while it is generated.
+
+    Elements are embroidered one by one, and each color block is sent as a
+    "color_block" event as soon as the next color starts.  The simulator can
+    show the first colors while the rest of the design is still being
+    stitched.
+
+    Events:
+      color_block  one ColorBlock, base64 encoded in the format of
+                   get_stitch_plan_binary(), as a stitch plan that only has
+                   this color block
+      end          the stitch plan without its color blocks (bounding_box,
+                   num_stitches, etc), sent after the last color block
+      error        {"error_message": ...} if stitch plan generation failed
+    """
+
+    def generate():
+        stitch_plan = StitchPlan()
+
+        try:
+            if g.extension.get_elements():
+                metadata = g.extension.get_inkstitch_metadata()
+                fingerprint = get_stitch_plan_fingerprint(metadata)
+                cached_stitch_plan = get_cached_stitch_plan(fingerprint)
+
+                if cached_stitch_plan is not None:
+                    color_blocks = cached_stitch_plan
+                else:
+                    color_blocks = generate_color_blocks(metadata)
+
+                for color_block in color_blocks:
+                    stitch_plan.add_color_block(color_block)
+                    yield _server_sent_event('color_block', b64encode(color_block_to_binary(color_block)).decode('ascii'))
+
+                if cached_stitch_plan is None:
+                    cache_stitch_plan(fingerprint, stitch_plan)
+        except Exception as exc:
+            yield _server_sent_event('error', {"error_message": _error_message(exc)})
+            return
+
+        summary = stitch_plan.__json__() if stitch_plan.color_blocks else {}
+        summary.pop('color_blocks', None)
+        summary['num_color_blocks'] = len(stitch_plan)
+        yield _server_sent_event('end', summary)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@stitch_plan.route('/range')
+def get_stitch_plan_range():
+    """Send some of the color blocks in the stitch plan.
+
+    Query parameters:
+      start  index of the first color block to send (default: 0)
+      stop   index after the last color block to send (default: all remaining)
+
+    The response contains the requested color blocks along with the summary
+    of the whole stitch plan, so that the caller knows how many color blocks
+    are left to fetch.
+    """
+
+    start = request.args.get('start', 0, type=int)
+    stop = request.args.get('stop', None, type=int)
+
+    if not g.extension.get_elements():
+        return dict(color_blocks=[], num_color_blocks=0, start=0, stop=0)
+
+    try:
+        metadata = g.extension.get_inkstitch_metadata()
+        fingerprint = get_stitch_plan_fingerprint(metadata)
+        stitch_plan = get_or_generate_stitch_plan(fingerprint, metadata)
+    except Exception as exc:
+        return jsonify({"error_message": _error_message(exc)}), 500
+
+    start, stop, step = slice(start, stop).indices(len(stitch_plan))
+    response = stitch_plan.__json__()
+    response['color_blocks'] = stitch_plan.color_blocks[start:stop]
+    response['num_color_blocks'] = len(stitch_plan)
+    response['start'] = start
+    response['stop'] = max(start, stop)
+
+    return jsonify(response)
+
+
+def _server_sent_event(event, data):
+    # The JSON provider doesn't indent, so the data is always a single line.
+    return f"event: {event}\ndata: {current_app.json.dumps(data)}\n\n"
+
+
+def stitch_plan_to_binary(stitch_plan):
+    if stitch_plan is None:
+        return _color_blocks_to_binary(dict(), [])
+    else:
+        return _color_blocks_to_binary(stitch_plan.__json__(), stitch_plan.color_blocks)
+
+
+def color_block_to_binary(color_block):
+    return _color_blocks_to_binary(dict(), [color_block])
+
+
+def _color_blocks_to_binary(header, color_blocks):
+    header['color_blocks'] = [dict(color=color_block.color, num_stitches=len(color_block.stitches))
+                              for color_block in color_blocks]
+    stitches = [stitch for color_block in color_blocks for stitch in color_block]
+    header['num_stitches'] = len(stitches)
+
+    header = current_app.json.dumps(header).encode('utf-8')
+    header += b' ' * (-len(header) % 4)
+
+    coordinates = np.array([(stitch.x, stitch.y) for stitch in stitches], dtype='<f4').reshape((-1, 2))
+    commands = np.array([_stitch_commands(stitch) for stitch in stitches], dtype=np.uint8)
+
+    return b''.join((
+        struct.pack('<I', len(header)),
+        header,
+        coordinates[:, 0].tobytes(),
+        coordinates[:, 1].tobytes(),
+        commands.tobytes()
+    ))
+
+
+def _stitch_commands(stitch):
+    return ((STITCH_JUMP if stitch.jump else 0) |
+            (STITCH_TRIM if stitch.trim else 0) |
+            (STITCH_STOP if stitch.stop else 0) |
+            (STITCH_COLOR_CHANGE if stitch.color_change else 0))
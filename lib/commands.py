@@ -5,10 +5,12 @@
 
 import os
 import sys
+from collections import defaultdict
 from copy import deepcopy
 from random import random
 
 import inkex
+from lxml import etree
 from shapely import geometry as shgeo
 
 from .i18n import N_, _
@@ -105,10 +107,10 @@ class BaseCommand(object):
 
         id = url[1:]
 
-        try:
-            return self.svg.xpath(".//*[@id='%s']" % id)[0]
-        except (IndexError, AttributeError):
+        node = get_command_index(self.svg).get_node_by_id(id)
+        if node is None:
             raise CommandParseError("could not find node by url %s" % id)
+        return node
 
 
 class Command(BaseCommand):
@@ -179,12 +181,75 @@ def get_command_description(command):
     return COMMANDS[command]
 
 
+class CommandIndex(object):
+    """Where the commands are in a document.
+
+    Looking up the commands of a node used to take an XPath query over the
+    whole document, and we do that for every node in the document.  Instead,
+    we go through the document once and remember the nodes by id, the
+    connectors by the id of the nodes they connect and the standalone command
+    symbols.
+
+    Use get_command_index() to get the index for a document.  The index
+    doesn't notice changes to the document, so call invalidate_command_index()
+    after adding or moving commands around.
+    """
+
+    def __init__(self, svg):
+        self.nodes_by_id = {}
+        self.connectors_by_id = defaultdict(list)
+        self.standalone_command_symbols = []
+        self._standalone_commands = None
+
+        for node in svg.iterdescendants(etree.Element):
+            id = node.get('id')
+            if id is not None:
+                # like XPath, the first node with this id wins
+                self.nodes_by_id.setdefault(id, node)
+
+            urls = {node.get(CONNECTION_START), node.get(CONNECTION_END)}
+            for url in urls:
+                if url is not None and url.startswith('#'):
+                    self.connectors_by_id[url[1:]].append(node)
+
+            if node.tag == SVG_USE_TAG and node.get(XLINK_HREF, "").startswith('#inkstitch_'):
+                self.standalone_command_symbols.append(node)
+
+    def get_node_by_id(self, id):
+        return self.nodes_by_id.get(id)
+
+    def get_connectors(self, id):
+        return self.connectors_by_id.get(id, [])
+
+    @property
+    def standalone_commands(self):
+        if self._standalone_commands is None:
+            self._standalone_commands = defaultdict(list)
+            for symbol in self.standalone_command_symbols:
+                try:
+                    command = StandaloneCommand(symbol)
+                except CommandParseError:
+                    continue
+                self._standalone_commands[command.command].append(command)
+
+        return self._standalone_commands
+
+
+@cache
+def get_command_index(svg):
+    return CommandIndex(svg)
+
+
+def invalidate_command_index():
+    get_command_index.cache_clear()
+    global_command.cache_clear()
+
+
 def find_commands(node):
     """Find the symbols this node is connected to and return them as Commands"""
 
     # find all paths that have this object as a connection
-    xpath = ".//*[@inkscape:connection-start='#%(id)s' or @inkscape:connection-end='#%(id)s']" % dict(id=node.get('id'))
-    connectors = node.getroottree().getroot().xpath(xpath, namespaces=inkex.NSS)
+    connectors = get_command_index(get_document(node)).get_connectors(node.get('id'))
 
     # try to turn them into commands
     commands = []
@@ -209,9 +274,7 @@ def layer_commands(layer, command):
 def global_commands(svg, command):
     """Find standalone (unconnected) command symbols anywhere in the document."""
 
-    for standalone_command in _standalone_commands(svg):
-        if standalone_command.command == command:
-            yield standalone_command
+    yield from get_command_index(svg).standalone_commands.get(command, [])
 
 
 @cache
@@ -240,19 +303,6 @@ def global_command(svg, command):
         return None
 
 
-def _standalone_commands(svg):
-    """Find all unconnected command symbols in the SVG."""
-
-    xpath = ".//svg:use[starts-with(@xlink:href, '#inkstitch_')]"
-    symbols = svg.xpath(xpath, namespaces=inkex.NSS)
-
-    for symbol in symbols:
-        try:
-            yield StandaloneCommand(symbol)
-        except CommandParseError:
-            pass
-
-
 def is_command(node):
     return CONNECTION_START in node.attrib or CONNECTION_END in node.attrib
 
@@ -413,6 +463,8 @@ def add_commands(element, commands, pos=None):
         symbol = add_symbol(svg, group, command, position)
         add_connector(svg, symbol, command, element)
 
+    invalidate_command_index()
+
 
 def add_layer_commands(layer, commands):
     svg = layer.root
@@ -441,3 +493,5 @@ def add_layer_commands(layer, commands):
             "y": "-10",
             "transform": correction_transform
         }))
+
+    invalidate_command_index()
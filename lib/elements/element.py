@@ -4,11 +4,9 @@
 # Licensed under the GNU GPL version 3.0 or later.  See the file LICENSE for details.
 import sys
 from contextlib import contextmanager
-from copy import deepcopy
 
 import inkex
 import numpy as np
-from inkex import bezier
 
 from ..commands import find_commands
 from ..debug import debug
@@ -22,7 +20,13 @@ from ..svg import (PIXELS_PER_MM, apply_transforms, convert_length,
                    get_node_transform)
 from ..svg.tags import INKSCAPE_LABEL, INKSTITCH_ATTRIBS
 from ..utils import Point, cache
-from ..utils.cache import get_stitch_plan_cache, CacheKeyGenerator
+from ..utils.bezier import flatten_csp
+from ..utils.cache import (CacheKeyGenerator, get_geometry_cache,
+                           get_stitch_plan_cache)
+
+
+# SVG attributes that define the shape of a node
+GEOMETRY_ATTRIBUTES = ('d', 'points', 'x', 'y', 'width', 'height', 'rx', 'ry', 'cx', 'cy', 'r', 'x1', 'y1', 'x2', 'y2')
 
 
 class Param(object):
@@ -397,14 +401,44 @@ class EmbroideryElement(object):
 
         return inkex.Path(d).to_superpath()
 
+    @cache
+    def get_geometry_cache_key(self, name):
+        """Cache key for geometry that depends only on the node's shape.
+
+        The key covers the node's geometry attributes and the transforms of
+        the node, its ancestors and the viewBox.  Different kinds of geometry
+        (e.g. the parsed path and the flattened path) are told apart by name.
+        """
+
+        cache_key_generator = CacheKeyGenerator()
+        cache_key_generator.update(name)
+        cache_key_generator.update(self.node.tag)
+        cache_key_generator.update(self.node.get('id'))
+        cache_key_generator.update([self.node.get(attrib) for attrib in GEOMETRY_ATTRIBUTES])
+        cache_key_generator.update(tuple(get_node_transform(self.node).to_hexad()))
+
+        return cache_key_generator.get_cache_key()
+
     @cache
     def parse_path(self):
-        return apply_transforms(self.path, self.node)
+        # Parsing is quick enough that reading it back from disk isn't worth it.
+        return get_geometry_cache().get(self.get_geometry_cache_key("parse_path"),
+                                        lambda: apply_transforms(self.path, self.node),
+                                        persist=False)
+
+    def get_flattened_path(self):
+        """Same as self.flatten(self.parse_path()), but cached.
+
+        This returns a new list every time, so the caller may modify it.
+        """
+
+        return get_geometry_cache().get(self.get_geometry_cache_key("flattened_path"),
+                                        lambda: self.flatten(self.parse_path()))
 
     @property
     @cache
     def paths(self):
-        return self.flatten(self.parse_path())
+        return self.get_flattened_path()
 
     @property
     def shape(self):
@@ -438,16 +472,10 @@ class EmbroideryElement(object):
     def flatten(self, path):
         """approximate a path containing beziers with a series of points"""
 
-        path = deepcopy(path)
-        bezier.cspsubdiv(path, 0.1)
-
-        return [self.strip_control_points(subpath) for subpath in path]
+        return [points.tolist() for points in flatten_csp(path, 0.1)]
 
     def flatten_subpath(self, subpath):
-        path = [deepcopy(subpath)]
-        bezier.cspsubdiv(path, 0.1)
-
-        return self.strip_control_points(path[0])
+        return flatten_csp([subpath], 0.1)[0].tolist()
 
     @property
     @cache
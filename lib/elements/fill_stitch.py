@@ -24,6 +24,7 @@ from ..svg import PIXELS_PER_MM, get_node_transform
 from ..svg.clip import get_clip_path
 from ..svg.tags import INKSCAPE_LABEL
 from ..utils import cache
+from ..utils.cache import get_geometry_cache
 from ..utils.geometry import ensure_multi_polygon
 from ..utils.param import ParamOption
 from .element import EmbroideryElement, param
@@ -568,7 +569,7 @@ class FillStitch(EmbroideryElement):
     @property
     @cache
     def paths(self):
-        paths = self.flatten(self.parse_path())
+        paths = self.get_flattened_path()
         # ensure path length
         for i, path in enumerate(paths):
             if len(path) < 3:
@@ -588,6 +589,13 @@ class FillStitch(EmbroideryElement):
     @property
     @cache
     def shape(self):
+        if self.node.clip is None:
+            # Without a clip path, the shape only depends on the node's geometry.
+            return get_geometry_cache().get(self.get_geometry_cache_key("fill_shape"), self._get_shape)
+
+        return self._get_shape()
+
+    def _get_shape(self):
         shape = self._get_clipped_path()
 
         if shape.is_valid:
@@ -21,6 +21,7 @@ from ..stitch_plan import StitchGroup
 from ..stitches import running_stitch
 from ..svg import line_strings_to_csp, point_lists_to_csp
 from ..utils import Point, cache, cut, cut_multiple, prng
+from ..utils.bezier import flatten_subpath
 from ..utils.param import ParamOption
 from ..utils.threading import check_stop_flag
 from .element import PIXELS_PER_MM, EmbroideryElement, param
@@ -298,7 +299,7 @@ class SatinColumn(EmbroideryElement):
         elif choice == 'both':
             return True, True
         elif choice == 'automatic':
-            rails = [shgeo.LineString(self.flatten_subpath(rail)) for rail in self.rails]
+            rails = [shgeo.LineString(flatten_subpath(rail)) for rail in self.rails]
             if len(rails) == 2:
                 # Sample ten points along the rails.  Compare the distance
                 # between corresponding points on both rails with and without
@@ -515,7 +516,7 @@ class SatinColumn(EmbroideryElement):
     @cache
     def flattened_rails(self):
         """The rails, as LineStrings."""
-        paths = [shgeo.LineString(self.flatten_subpath(rail)) for rail in self.rails]
+        paths = [shgeo.LineString(flatten_subpath(rail)) for rail in self.rails]
 
         rails_to_reverse = self._get_rails_to_reverse()
         if paths and rails_to_reverse is not None:
@@ -528,7 +529,7 @@ class SatinColumn(EmbroideryElement):
     @property
     @cache
     def flattened_rungs(self):
-        return tuple(shgeo.LineString(self.flatten_subpath(rung)) for rung in self.rungs)
+        return tuple(shgeo.LineString(flatten_subpath(rung)) for rung in self.rungs)
 
     @property
     @cache
@@ -582,8 +583,7 @@ class SatinColumn(EmbroideryElement):
     @property
     @cache
     def rail_indices(self):
-        paths = [self.flatten_subpath(subpath) for subpath in self.csp]
-        paths = [shgeo.LineString(path) for path in paths]
+        paths = [shgeo.LineString(flatten_subpath(subpath)) for subpath in self.csp]
         num_paths = len(paths)
 
         # Imagine a satin column as a curvy ladder.
@@ -722,7 +722,7 @@ class SatinColumn(EmbroideryElement):
         # have two rails with different number of points, and still no rungs, let's add one.
 
         if not self.rungs:
-            rails = [shgeo.LineString(reversed(self.flatten_subpath(rail))) for rail in self.rails]
+            rails = [shgeo.LineString(flatten_subpath(rail)[::-1]) for rail in self.rails]
             rails.reverse()
             path_list = rails
 
@@ -812,7 +812,7 @@ class SatinColumn(EmbroideryElement):
           rails.  Each element is a list of two rails of type LineString.
         """
 
-        rails = [shgeo.LineString(self.flatten_subpath(rail)) for rail in self.rails]
+        rails = [shgeo.LineString(flatten_subpath(rail)) for rail in self.rails]
 
         path_lists = [[], []]
 
@@ -845,7 +845,7 @@ class SatinColumn(EmbroideryElement):
         Each rung is appended to the correct one of the two new satin columns.
         """
 
-        rungs = [shgeo.LineString(self.flatten_subpath(rung)) for rung in self.rungs]
+        rungs = [shgeo.LineString(flatten_subpath(rung)) for rung in self.rungs]
         for path_list in split_rails:
             path_list.extend(rung for rung in rungs if path_list[0].intersects(rung) and path_list[1].intersects(rung))
 
@@ -381,7 +381,7 @@ class Stroke(EmbroideryElement):
     @property
     def paths(self):
         path = self.parse_path()
-        flattened = self.flatten(path)
+        flattened = self.get_flattened_path()
         flattened = self._get_clipped_path(flattened)
 
         # manipulate invalid path
@@ -3,116 +3,99 @@
 # Copyright (c) 2010 Authors
 # Licensed under the GNU GPL version 3.0 or later.  See the file LICENSE for details.
 
-from lib.extensions.troubleshoot import Troubleshoot
+from importlib import import_module
+
+# Extension class name -> the module in this package that defines it.
+#
+# Inkscape starts a new process every time it runs an extension.  Between them,
+# the extensions import nearly everything (wx, flask, scipy, networkx, ...), so
+# we import only the module of the extension that is actually requested.
+EXTENSION_MODULES = {
+    'ApplyThreadlist': 'apply_threadlist',
+    'AutoRun': 'auto_run',
+    'AutoSatin': 'auto_satin',
+    'BreakApart': 'break_apart',
+    'Cleanup': 'cleanup',
+    'CommandsScaleSymbols': 'commands_scale_symbols',
+    'ConvertToSatin': 'convert_to_satin',
+    'ConvertToStroke': 'convert_to_stroke',
+    'CutSatin': 'cut_satin',
+    'CutworkSegmentation': 'cutwork_segmentation',
+    'DensityMap': 'density_map',
+    'DisplayStackingOrder': 'display_stacking_order',
+    'DuplicateParams': 'duplicate_params',
+    'ElementInfo': 'element_info',
+    'FillToStroke': 'fill_to_stroke',
+    'Flip': 'flip',
+    'GeneratePalette': 'generate_palette',
+    'GlobalCommands': 'global_commands',
+    'GradientBlocks': 'gradient_blocks',
+    'Input': 'input',
+    'Install': 'install',
+    'InstallCustomPalette': 'install_custom_palette',
+    'JumpToStroke': 'jump_to_stroke',
+    'LayerCommands': 'layer_commands',
+    'Lettering': 'lettering',
+    'LetteringAlongPath': 'lettering_along_path',
+    'LetteringCustomFontDir': 'lettering_custom_font_dir',
+    'LetteringForceLockStitches': 'lettering_force_lock_stitches',
+    'LetteringGenerateJson': 'lettering_generate_json',
+    'LetteringRemoveKerning': 'lettering_remove_kerning',
+    'LetteringUpdateJsonGlyphlist': 'lettering_update_json_glyphlist',
+    'LettersToFont': 'letters_to_font',
+    'ObjectCommands': 'object_commands',
+    'ObjectCommandsToggleVisibility': 'object_commands_toggle_visibility',
+    'Outline': 'outline',
+    'Output': 'output',
+    'PaletteSplitText': 'palette_split_text',
+    'PaletteToText': 'palette_to_text',
+    'Params': 'params',
+    'Preferences': 'preferences',
+    'Print': 'print_pdf',
+    'RemoveEmbroiderySettings': 'remove_embroidery_settings',
+    'Reorder': 'reorder',
+    'SelectElements': 'select_elements',
+    'SelectionToGuideLine': 'selection_to_guide_line',
+    'SelectionToPattern': 'selection_to_pattern',
+    'Simulator': 'simulator',
+    'StitchPlanPreview': 'stitch_plan_preview',
+    'StitchPlanPreviewUndo': 'stitch_plan_preview_undo',
+    'StrokeToLpeSatin': 'stroke_to_lpe_satin',
+    'TestSwatches': 'test_swatches',
+    'Troubleshoot': 'troubleshoot',
+    'UpdateSvg': 'update_svg',
+    'ZigzagLineToSatin': 'zigzag_line_to_satin',
+    'Zip': 'zip',
+}
+
+__all__ = list(EXTENSION_MODULES)
+
+
+def get_extension_class(class_name):
+    """Import the extension class with the given name.
+
+    Raises:
+        AttributeError if there is no such extension
+    """
+
+    try:
+        module_name = EXTENSION_MODULES[class_name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {class_name!r}")
+
+    return getattr(import_module(f'.{module_name}', __name__), class_name)
+
+
+def get_extensions():
+    """Import all extension classes.  This is slow, so only do it when they're really all needed."""
+
+    return [get_extension_class(class_name) for class_name in EXTENSION_MODULES]
 
-from .apply_threadlist import ApplyThreadlist
-from .auto_run import AutoRun
-from .auto_satin import AutoSatin
-from .break_apart import BreakApart
-from .cleanup import Cleanup
-from .commands_scale_symbols import CommandsScaleSymbols
-from .convert_to_satin import ConvertToSatin
-from .convert_to_stroke import ConvertToStroke
-from .cut_satin import CutSatin
-from .cutwork_segmentation import CutworkSegmentation
-from .density_map import DensityMap
-from .display_stacking_order import DisplayStackingOrder
-from .duplicate_params import DuplicateParams
-from .element_info import ElementInfo
-from .fill_to_stroke import FillToStroke
-from .flip import Flip
-from .generate_palette import GeneratePalette
-from .global_commands import GlobalCommands
-from .gradient_blocks import GradientBlocks
-from .input import Input
-from .install import Install
-from .install_custom_palette import InstallCustomPalette
-from .jump_to_stroke import JumpToStroke
-from .layer_commands import LayerCommands
-from .lettering import Lettering
-from .lettering_custom_font_dir import LetteringCustomFontDir
-from .lettering_force_lock_stitches import LetteringForceLockStitches
-from .lettering_generate_json import LetteringGenerateJson
-from .lettering_remove_kerning import LetteringRemoveKerning
-from .lettering_update_json_glyphlist import LetteringUpdateJsonGlyphlist
-from .letters_to_font import LettersToFont
-from .object_commands import ObjectCommands
-from .object_commands_toggle_visibility import ObjectCommandsToggleVisibility
-from .outline import Outline
-from .output import Output
-from .palette_split_text import PaletteSplitText
-from .palette_to_text import PaletteToText
-from .params import Params
-from .preferences import Preferences
-from .print_pdf import Print
-from .remove_embroidery_settings import RemoveEmbroiderySettings
-from .reorder import Reorder
-from .select_elements import SelectElements
-from .selection_to_guide_line import SelectionToGuideLine
-from .selection_to_pattern import SelectionToPattern
-from .simulator import Simulator
-from .stitch_plan_preview import StitchPlanPreview
-from .stitch_plan_preview_undo import StitchPlanPreviewUndo
-from .stroke_to_lpe_satin import StrokeToLpeSatin
-from .test_swatches import TestSwatches
-from .update_svg import UpdateSvg
-from .zigzag_line_to_satin import ZigzagLineToSatin
-from .zip import Zip
 
-from.lettering_along_path import LetteringAlongPath
+def __getattr__(name):
+    # "from lib.extensions import Params" and "lib.extensions.extensions" keep
+    # working, but they only import what they need when they're used.
+    if name == 'extensions':
+        return get_extensions()
 
-__all__ = extensions = [ApplyThreadlist,
-                        AutoRun,
-                        AutoSatin,
-                        BreakApart,
-                        Cleanup,
-                        CommandsScaleSymbols,
-                        ConvertToSatin,
-                        ConvertToStroke,
-                        CutSatin,
-                        CutworkSegmentation,
-                        DensityMap,
-                        DisplayStackingOrder,
-                        DuplicateParams,
-                        ElementInfo,
-                        FillToStroke,
-                        Flip,
-                        GeneratePalette,
-                        GlobalCommands,
-                        GradientBlocks,
-                        Input,
-                        Install,
-                        InstallCustomPalette,
-                        JumpToStroke,
-                        LayerCommands,
-                        Lettering,
-                        LetteringAlongPath,
-                        LetteringCustomFontDir,
-                        LetteringForceLockStitches,
-                        LetteringGenerateJson,
-                        LetteringRemoveKerning,
-                        LetteringUpdateJsonGlyphlist,
-                        LettersToFont,
-                        ObjectCommands,
-                        ObjectCommandsToggleVisibility,
-                        Outline,
-                        Output,
-                        PaletteSplitText,
-                        PaletteToText,
-                        Params,
-                        Preferences,
-                        Print,
-                        RemoveEmbroiderySettings,
-                        Reorder,
-                        SelectElements,
-                        SelectionToGuideLine,
-                        SelectionToPattern,
-                        Simulator,
-                        StitchPlanPreview,
-                        StitchPlanPreviewUndo,
-                        StrokeToLpeSatin,
-                        TestSwatches,
-                        Troubleshoot,
-                        UpdateSvg,
-                        ZigzagLineToSatin,
-                        Zip]
+    return get_extension_class(name)
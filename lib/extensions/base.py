@@ -8,11 +8,11 @@ import os
 import inkex
 from lxml.etree import Comment
 
-from ..commands import is_command, layer_commands
+from ..commands import invalidate_command_index, is_command, layer_commands
 from ..elements import EmbroideryElement, nodes_to_elements
 from ..elements.clone import is_clone
 from ..i18n import _
-from ..marker import has_marker
+from ..marker import has_marker, invalidate_marker_index
 from ..metadata import InkStitchMetadata
 from ..svg import generate_unique_id
 from ..svg.tags import (CONNECTOR_TYPE, EMBROIDERABLE_TAGS, INKSCAPE_GROUPMODE,
@@ -113,6 +113,11 @@ class InkstitchExtension(inkex.EffectExtension):
     def get_nodes(self, troubleshoot=False):
         # Postorder traversal of selected nodes and their descendants.
         # Returns all nodes if there is no selection.
+
+        # The document may have changed since we last looked at its commands
+        # and markers.
+        invalidate_command_index()
+        invalidate_marker_index()
         return self.descendants(self.document.getroot(), troubleshoot=troubleshoot)
 
     def get_elements(self, troubleshoot=False):
@@ -124,16 +129,17 @@ class InkstitchExtension(inkex.EffectExtension):
         return False
 
     def elements_to_stitch_groups(self, elements):
-        patches = []
+        return list(self.iter_stitch_groups(elements))
+
+    def iter_stitch_groups(self, elements):
+        """Embroider elements one at a time, yielding their StitchGroups as we go."""
+        last_patch = None
         for element in elements:
+            patches = element.embroider(last_patch)
             if patches:
                 last_patch = patches[-1]
-            else:
-                last_patch = None
-
-            patches.extend(element.embroider(last_patch))
 
-        return patches
+            yield from patches
 
     def get_inkstitch_metadata(self):
         return InkStitchMetadata(self.svg)
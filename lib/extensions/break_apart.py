@@ -42,7 +42,7 @@ class BreakApart(InkstitchExtension):
                 continue
 
             # we don't want to touch valid elements
-            paths = element.flatten(element.parse_path())
+            paths = element.get_flattened_path()
             try:
                 paths.sort(key=lambda point_list: Polygon(point_list).area, reverse=True)
                 polygon = MultiPolygon([(paths[0], paths[1:])])
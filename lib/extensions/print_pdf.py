@@ -11,7 +11,7 @@ import sys
 import time
 from copy import deepcopy
 from datetime import date
-from threading import Thread
+from threading import Lock, Thread
 from contextlib import closing
 
 import appdirs
@@ -24,8 +24,9 @@ from ..gui import open_url
 from ..i18n import get_languages
 from ..i18n import translation as inkstitch_translation
 from ..stitch_plan import stitch_groups_to_stitch_plan
-from ..svg import render_stitch_plan
-from ..svg.tags import INKSCAPE_GROUPMODE
+from ..svg import (add_realistic_filter, get_stitch_plan_layer,
+                   render_color_block)
+from ..svg.tags import INKSCAPE_GROUPMODE, SVG_GROUP_TAG
 from ..threads import ThreadCatalog
 from .base import InkstitchExtension
 
@@ -62,8 +63,7 @@ class PrintPreviewServer(Thread):
         self.html = kwargs.pop('html')
         self.metadata = kwargs.pop('metadata')
         self.stitch_plan = kwargs.pop('stitch_plan')
-        self.realistic_overview_svg = kwargs.pop('realistic_overview_svg')
-        self.realistic_color_block_svgs = kwargs.pop('realistic_color_block_svgs')
+        self.renderer = kwargs.pop('renderer')
         Thread.__init__(self, *args, **kwargs)
         self.daemon = True
         self.flask_server = None
@@ -149,11 +149,11 @@ class PrintPreviewServer(Thread):
 
         @self.app.route('/realistic/block<int:index>', methods=['GET'])
         def get_realistic_block(index):
-            return Response(self.realistic_color_block_svgs[index], mimetype='image/svg+xml')
+            return Response(self.renderer.get_realistic_color_block_svg(index), mimetype='image/svg+xml')
 
         @self.app.route('/realistic/overview', methods=['GET'])
         def get_realistic_overview():
-            return Response(self.realistic_overview_svg, mimetype='image/svg+xml')
+            return Response(self.renderer.get_realistic_overview_svg(), mimetype='image/svg+xml')
 
     def stop(self):
         self.flask_server.shutdown()
@@ -182,6 +182,98 @@ class PrintPreviewServer(Thread):
         self.server_thread.start()
 
 
+class PrintRenderer(object):
+    """Render the stitch plan into the SVGs shown in the print preview.
+
+    Each SVG contains the stitch plan (or just one of its color blocks) and
+    whatever else the document has outside of its layers, such as <defs>.
+
+    Realistic SVGs take a long time to render and are only shown if the user
+    asks for them, so they are rendered the first time one is requested.
+    """
+
+    def __init__(self, document, stitch_plan):
+        self.stitch_plan = stitch_plan
+        self.empty_svg = self._get_empty_svg(document.getroot())
+
+        self._realistic_svgs = None
+        self._realistic_svgs_lock = Lock()
+
+    def _get_empty_svg(self, root):
+        # The layers are the bulk of the document and we don't need them, so
+        # don't bother copying them.
+        svg = root.makeelement(root.tag, root.attrib, nsmap=root.nsmap)
+        svg.text = root.text
+        for child in root:
+            if child.tag == SVG_GROUP_TAG and child.get(INKSCAPE_GROUPMODE) == "layer":
+                continue
+            svg.append(deepcopy(child))
+
+        # objects outside of the viewbox are invisible
+        # TODO: if we want them to be seen, we need to redefine document size to fit the design
+        #       this is just a quick fix and doesn't work on realistic view
+        svg.set('style', 'overflow:visible;')
+
+        return svg
+
+    def render_svgs(self, realistic=False):
+        """Render the overview and each color block.
+
+        Returns:
+            (overview SVG, [color block SVG, ...])
+        """
+
+        svg = deepcopy(self.empty_svg)
+        layer = get_stitch_plan_layer(svg)
+
+        for i, color_block in enumerate(self.stitch_plan):
+            render_color_block(svg, layer, color_block, i, realistic, visual_commands=False)
+
+        if realistic:
+            add_realistic_filter(svg)
+
+        strip_namespaces(svg)
+
+        # Now the stitch plan layer contains a group for each color block.
+        # We'll serialize the SVG once with all of them for the overview and
+        # then once with each group on its own.
+        overview_svg = etree.tostring(svg).decode('utf-8')
+        color_block_groups = layer.getchildren()
+        color_block_svgs = []
+
+        for group in color_block_groups:
+            # clear the stitch plan layer
+            del layer[:]
+
+            # add in just this group
+            layer.append(group)
+
+            # save an SVG preview
+            color_block_svgs.append(etree.tostring(svg).decode('utf-8'))
+
+        return overview_svg, color_block_svgs
+
+    def get_realistic_overview_svg(self):
+        return self._get_realistic_svgs()[0]
+
+    def get_realistic_color_block_svg(self, index):
+        return self._get_realistic_svgs()[1][index]
+
+    def _get_realistic_svgs(self):
+        with self._realistic_svgs_lock:
+            if self._realistic_svgs is None:
+                self._realistic_svgs = self.render_svgs(realistic=True)
+
+            return self._realistic_svgs
+
+
+def strip_namespaces(svg):
+    # namespace prefixes seem to trip up HTML, so get rid of them
+    for element in svg.iter():
+        if isinstance(element.tag, str) and element.tag[0] == '{':
+            element.tag = element.tag[element.tag.index('}', 1) + 1:]
+
+
 class Print(InkstitchExtension):
     def build_environment(self):
         if getattr(sys, 'frozen', False):
@@ -213,56 +305,6 @@ class Print(InkstitchExtension):
 
         return env
 
-    def strip_namespaces(self, svg):
-        # namespace prefixes seem to trip up HTML, so get rid of them
-        for element in svg.iter():
-            if isinstance(element.tag, str) and element.tag[0] == '{':
-                element.tag = element.tag[element.tag.index('}', 1) + 1:]
-
-    def render_svgs(self, stitch_plan, realistic=False):
-        svg = deepcopy(self.document).getroot()
-        render_stitch_plan(svg, stitch_plan, realistic, visual_commands=False)
-
-        self.strip_namespaces(svg)
-
-        # Now the stitch plan layer will contain a set of groups, each
-        # corresponding to a color block.  We'll create a set of SVG files
-        # corresponding to each individual color block and a final one
-        # for all color blocks together.
-
-        layers = svg.findall("./g[@%s='layer']" % INKSCAPE_GROUPMODE)
-        stitch_plan_layer = svg.findone(".//*[@id='__inkstitch_stitch_plan__']")
-
-        # Make sure there is no leftover translation from stitch plan preview
-        stitch_plan_layer.pop('transform')
-
-        # objects outside of the viewbox are invisible
-        # TODO: if we want them to be seen, we need to redefine document size to fit the design
-        #       this is just a quick fix and doesn't work on realistic view
-        svg.set('style', 'overflow:visible;')
-
-        # First, delete all of the other layers.  We don't need them and they'll
-        # just bulk up the SVG.
-        for layer in layers:
-            if layer is not stitch_plan_layer:
-                svg.remove(layer)
-
-        overview_svg = etree.tostring(svg).decode('utf-8')
-        color_block_groups = stitch_plan_layer.getchildren()
-        color_block_svgs = []
-
-        for i, group in enumerate(color_block_groups):
-            # clear the stitch plan layer
-            del stitch_plan_layer[:]
-
-            # add in just this group
-            stitch_plan_layer.append(group)
-
-            # save an SVG preview
-            color_block_svgs.append(etree.tostring(svg).decode('utf-8'))
-
-        return overview_svg, color_block_svgs
-
     def render_html(self, stitch_plan, overview_svg, selected_palette):
         env = self.build_environment()
         template = env.get_template('index.html')
@@ -314,8 +356,8 @@ class Print(InkstitchExtension):
         stitch_plan = stitch_groups_to_stitch_plan(patches, collapse_len=collapse_len, min_stitch_len=min_stitch_len)
         palette = ThreadCatalog().match_and_apply_palette(stitch_plan, self.get_inkstitch_metadata()['thread-palette'])
 
-        overview_svg, color_block_svgs = self.render_svgs(stitch_plan, realistic=False)
-        realistic_overview_svg, realistic_color_block_svgs = self.render_svgs(stitch_plan, realistic=True)
+        renderer = PrintRenderer(self.document, stitch_plan)
+        overview_svg, color_block_svgs = renderer.render_svgs(realistic=False)
 
         for i, svg in enumerate(color_block_svgs):
             stitch_plan.color_blocks[i].svg_preview = svg
@@ -326,8 +368,7 @@ class Print(InkstitchExtension):
             html=html,
             metadata=self.get_inkstitch_metadata(),
             stitch_plan=stitch_plan,
-            realistic_overview_svg=realistic_overview_svg,
-            realistic_color_block_svgs=realistic_color_block_svgs
+            renderer=renderer
         )
         print_server.start()
         # Wait for print_server.host and print_server.port to be populated.
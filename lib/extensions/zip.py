@@ -5,8 +5,7 @@
 
 import os
 import sys
-import tempfile
-from copy import deepcopy
+from io import BytesIO
 from zipfile import ZipFile
 
 from inkex import Boolean, errormsg
@@ -15,7 +14,7 @@ from lxml import etree
 import pyembroidery
 
 from ..i18n import _
-from ..output import write_embroidery_file
+from ..output import get_embroidery_pattern, write_embroidery
 from ..stitch_plan import stitch_groups_to_stitch_plan
 from ..svg import PIXELS_PER_MM
 from ..threads import ThreadCatalog
@@ -61,51 +60,49 @@ class Zip(InkstitchExtension):
             stitch_plan = self._make_offsets(stitch_plan)
 
         base_file_name = self._get_file_name()
-        path = tempfile.mkdtemp()
-
-        files = []
-
-        for format in self.formats:
-            if getattr(self.options, format):
-                output_file = os.path.join(path, "%s.%s" % (base_file_name, format))
-                if format == 'svg':
-                    document = deepcopy(self.document.getroot())
-                    with open(output_file, 'w', encoding='utf-8') as svg:
-                        svg.write(etree.tostring(document).decode('utf-8'))
-                elif format == 'threadlist':
-                    output_file = os.path.join(path, "%s_%s.txt" % (base_file_name, _("threadlist")))
-                    output = open(output_file, 'w', encoding='utf-8')
-                    output.write(self.get_threadlist(stitch_plan, base_file_name))
-                    output.close()
-                else:
-                    write_embroidery_file(output_file, stitch_plan, self.document.getroot())
-                files.append(output_file)
-
-        if not files:
-            errormsg(_("No embroidery file formats selected."))
-
-        temp_file = tempfile.NamedTemporaryFile(suffix=".zip", delete=False)
-
-        # in windows, failure to close here will keep the file locked
-        temp_file.close()
-
-        with ZipFile(temp_file.name, "w") as zip_file:
-            for file in files:
-                zip_file.write(file, os.path.basename(file))
+        formats = [format for format in self.formats if getattr(self.options, format)]
 
-        # inkscape will read the file contents from stdout and copy
-        # to the destination file that the user chose
-        with open(temp_file.name, 'rb') as output_file:
-            sys.stdout.buffer.write(output_file.read())
+        if not formats:
+            errormsg(_("No embroidery file formats selected."))
 
-        os.remove(temp_file.name)
-        for file in files:
-            os.remove(file)
-        os.rmdir(path)
+        # All formats are written from the same pyembroidery pattern.
+        pattern = None
+        if set(formats) - {'svg', 'threadlist', 'png'}:
+            pattern = get_embroidery_pattern(stitch_plan, self.document.getroot())
+
+        if sys.platform == "win32":
+            import msvcrt
+            msvcrt.setmode(sys.stdout.fileno(), os.O_BINARY)
+
+        # Add each file to the archive as soon as it's encoded.  Inkscape will
+        # read the archive from stdout and copy it to the destination file that
+        # the user chose.
+        with ZipFile(sys.stdout.buffer, "w") as zip_file:
+            for format in formats:
+                if format == 'threadlist':
+                    continue
+                file_name = "%s.%s" % (base_file_name, format)
+                zip_file.writestr(file_name, self._encode(format, stitch_plan, pattern))
+
+            # This applies the thread palette to the stitch plan, so it has
+            # to come after the other formats.
+            if 'threadlist' in formats:
+                file_name = "%s_%s.txt" % (base_file_name, _("threadlist"))
+                zip_file.writestr(file_name, self.get_threadlist(stitch_plan, base_file_name).encode('utf-8'))
+
+        sys.stdout.flush()
 
         # don't let inkex output the SVG!
         sys.exit(0)
 
+    def _encode(self, format, stitch_plan, pattern):
+        if format == 'svg':
+            return etree.tostring(self.document.getroot())
+
+        output = BytesIO()
+        write_embroidery(output, format, stitch_plan, self.document.getroot(), pattern=pattern)
+        return output.getvalue()
+
     def _get_file_name(self):
         if self.options.custom_file_name:
             base_file_name = self.options.custom_file_name
@@ -6,7 +6,8 @@
 import wx
 
 from ..i18n import _
-from ..utils.cache import get_stitch_plan_cache
+from ..utils.cache import (get_geometry_cache, get_stitch_plan_cache,
+                           update_cache_size_limits)
 from ..utils.settings import global_settings
 
 
@@ -179,6 +180,7 @@ class PreferencesFrame(wx.Frame):
     def clear_cache(self, event):
         stitch_plan_cache = get_stitch_plan_cache()
         stitch_plan_cache.clear(retry=True)
+        get_geometry_cache().clear()
 
     def apply(self):
         metadata = self.extension.get_inkstitch_metadata()
@@ -190,9 +192,7 @@ class PreferencesFrame(wx.Frame):
         global_settings['cache_size'] = self.stitch_plan_cache_size.GetValue()
 
         # cache size may have changed
-        stitch_plan_cache = get_stitch_plan_cache()
-        stitch_plan_cache.size_limit = int(global_settings['cache_size'] * 1024 * 1024)
-        stitch_plan_cache.cull()
+        update_cache_size_limits()
 
     def cancel_button_clicked(self, event):
         self.Destroy()
@@ -7,7 +7,7 @@ import pyembroidery
 
 from ..commands import (COMMANDS, GLOBAL_COMMANDS, LAYER_COMMANDS,
                         OBJECT_COMMANDS)
-from ..extensions import Input, Output, extensions
+from ..extensions import Input, Output, get_extensions
 from ..lettering.categories import FONT_CATEGORIES
 from ..threads import ThreadCatalog
 from .outputs import pyembroidery_output_formats
@@ -43,7 +43,7 @@ def threadcatalog():
 def generate_extension_inx_files(alter_data):
     env = build_environment()
 
-    for extension in extensions:
+    for extension in get_extensions():
         if extension is Input or extension is Output:
             continue
 
@@ -10,12 +10,13 @@ from random import randint
 
 import inkex
 
-from ..commands import add_commands, ensure_symbol
+from ..commands import add_commands, ensure_symbol, invalidate_command_index
 from ..elements import SatinColumn, Stroke, nodes_to_elements
 from ..exceptions import InkstitchException
 from ..extensions.lettering_custom_font_dir import get_custom_font_dir
 from ..i18n import _, get_languages
-from ..marker import MARKER, ensure_marker, has_marker
+from ..marker import (MARKER, ensure_marker, has_marker,
+                      invalidate_marker_index)
 from ..stitches.auto_satin import auto_satin
 from ..svg.tags import (CONNECTION_END, CONNECTION_START, EMBROIDERABLE_TAGS,
                         INKSCAPE_LABEL, INKSTITCH_ATTRIBS, SVG_GROUP_TAG,
@@ -215,6 +216,10 @@ class Font(object):
             position.x = 0
             position.y += self.leading
 
+        # the glyphs brought their own commands and markers along
+        invalidate_command_index()
+        invalidate_marker_index()
+
         if self.auto_satin and len(destination_group) > 0:
             self._apply_auto_satin(destination_group)
 
@@ -3,14 +3,17 @@
 # Copyright (c) 2022 Authors
 # Licensed under the GNU GPL version 3.0 or later.  See the file LICENSE for details.
 
+from collections import defaultdict
 from copy import deepcopy
 from os import path
 
-from inkex import NSS, Style, load_svg
+import shapely
+from inkex import Style, load_svg
 from shapely import geometry as shgeo
 
-from .svg.tags import EMBROIDERABLE_TAGS
+from .svg.tags import EMBROIDERABLE_TAGS, SVG_GROUP_TAG
 from .utils import cache, get_bundled_dir
+from .utils.cache import CacheKeyGenerator
 
 MARKER = ['pattern', 'guide-line']
 
@@ -30,6 +33,7 @@ def _marker_svg():
 
 def set_marker(node, position, marker):
     ensure_marker(node.getroottree().getroot(), marker)
+    invalidate_marker_index()
 
     # attach marker to node
     style = node.style
@@ -37,52 +41,123 @@ def set_marker(node, position, marker):
     node.set('style', style)
 
 
+class MarkerGroup(object):
+    """The marker elements of one kind in one group.
+
+    The shapes are only built once, no matter how many elements in the group
+    use them.
+    """
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    @property
+    @cache
+    def fills(self):
+        from .elements import EmbroideryElement
+        from .elements.fill_stitch import FillStitch
+
+        return [FillStitch(node).shape for node in self.nodes if EmbroideryElement(node).get_style('fill') is not None]
+
+    @property
+    @cache
+    def strokes(self):
+        from .elements import EmbroideryElement
+        from .elements.stroke import Stroke
+
+        strokes = []
+        for node in self.nodes:
+            if EmbroideryElement(node).get_style('stroke') is not None:
+                line_strings = [shgeo.LineString(path) for path in Stroke(node).paths]
+                strokes.append(shgeo.MultiLineString(line_strings))
+        return strokes
+
+    @property
+    @cache
+    def satins(self):
+        from .elements import EmbroideryElement
+        from .elements.satin_column import SatinColumn
+
+        satins = []
+        for node in self.nodes:
+            if EmbroideryElement(node).get_style('stroke') is not None:
+                satin = SatinColumn(node)
+                if len(satin.rails) == 2:
+                    satins.append(satin)
+        return satins
+
+    @cache
+    def get_cache_key(self, get_satins=True):
+        cache_key_generator = CacheKeyGenerator()
+        cache_key_generator.update([shapely.to_wkb(shape) for shape in self.fills])
+        cache_key_generator.update([shapely.to_wkb(shape) for shape in self.strokes])
+        if get_satins:
+            cache_key_generator.update([satin.csp for satin in self.satins])
+        return cache_key_generator.get_cache_key()
+
+
+class MarkerIndex(object):
+    """The marker elements in a document, by the group they're in.
+
+    Marker elements apply to every element in the same group.  We find them
+    all in one pass instead of searching the group for every element.
+
+    Use get_marker_index() to get the index for a document.  The index
+    doesn't notice changes to the document, so call invalidate_marker_index()
+    after adding markers or moving them around.
+    """
+
+    def __init__(self, svg):
+        # do not close marker-start:url(
+        # if the marker group has been copied and pasted in Inkscape it may have been duplicated with an updated id (e.g. -4)
+        marker_styles = {marker: "marker-start:url(#inkstitch-%s-marker" % marker for marker in MARKER}
+        nodes = defaultdict(list)
+
+        for node in svg.iterdescendants(EMBROIDERABLE_TAGS):
+            style = node.get('style')
+            if not style or 'marker-start:url(#inkstitch-' not in style:
+                continue
+
+            parent = node.getparent()
+            if parent.tag != SVG_GROUP_TAG:
+                continue
+
+            for marker, marker_style in marker_styles.items():
+                if marker_style in style:
+                    nodes[(parent, marker)].append(node)
+
+        self.groups = {key: MarkerGroup(marker_nodes) for key, marker_nodes in nodes.items()}
+        self.empty_group = MarkerGroup([])
+
+    def get_marker_group(self, node, marker):
+        return self.groups.get((node.getparent(), marker), self.empty_group)
+
+
+@cache
+def get_marker_index(svg):
+    return MarkerIndex(svg)
+
+
+def invalidate_marker_index():
+    get_marker_index.cache_clear()
+
+
+def get_marker_group(node, marker):
+    return get_marker_index(node.getroottree().getroot()).get_marker_group(node, marker)
+
+
 def get_marker_elements(node, marker, get_fills=True, get_strokes=True, get_satins=False):
-    from .elements import EmbroideryElement
-    from .elements.fill_stitch import FillStitch
-    from .elements.satin_column import SatinColumn
-    from .elements.stroke import Stroke
-
-    fills = []
-    strokes = []
-    satins = []
-    # do not close marker-start:url(
-    # if the marker group has been copied and pasted in Inkscape it may have been duplicated with an updated id (e.g. -4)
-    xpath = "./parent::svg:g/*[contains(@style, 'marker-start:url(#inkstitch-%s-marker')]" % marker
-    markers = node.xpath(xpath, namespaces=NSS)
-    for marker in markers:
-        if marker.tag not in EMBROIDERABLE_TAGS:
-            continue
-
-        element = EmbroideryElement(marker)
-        fill = element.get_style('fill')
-        stroke = element.get_style('stroke')
-
-        if get_fills and fill is not None:
-            fill = FillStitch(marker).shape
-            fills.append(fill)
-
-        if get_strokes and stroke is not None:
-            stroke = Stroke(marker).paths
-            line_strings = [shgeo.LineString(path) for path in stroke]
-            strokes.append(shgeo.MultiLineString(line_strings))
-
-        if get_satins and stroke is not None:
-            satin = SatinColumn(marker)
-            if len(satin.rails) == 2:
-                satins.append(satin)
+    marker_group = get_marker_group(node, marker)
+
+    fills = list(marker_group.fills) if get_fills else []
+    strokes = list(marker_group.strokes) if get_strokes else []
+    satins = list(marker_group.satins) if get_satins else []
 
     return {'fill': fills, 'stroke': strokes, 'satin': satins}
 
 
 def get_marker_elements_cache_key_data(node, marker):
-    marker_elements = get_marker_elements(node, marker, True, True, True)
-
-    marker_elements['fill'] = [shape.wkt for shape in marker_elements['fill']]
-    marker_elements['stroke'] = [shape.wkt for shape in marker_elements['stroke']]
-    marker_elements['satin'] = [satin.csp for satin in marker_elements['satin']]
-
-    return marker_elements
+    return get_marker_group(node, marker).get_cache_key()
 
 
 def has_marker(node, marker=list()):
@@ -3,6 +3,7 @@
 # Copyright (c) 2010 Authors
 # Licensed under the GNU GPL version 3.0 or later.  See the file LICENSE for details.
 
+import io
 import os
 import sys
 
@@ -52,13 +53,11 @@ def jump_to_stop_point(pattern, svg):
         pattern.add_stitch_absolute(pyembroidery.JUMP, stop_position.point.x, stop_position.point.y)
 
 
-def write_embroidery_file(file_path, stitch_plan, svg, settings={}):
-    # convert from pixels to millimeters
-    # also multiply by 10 to get tenths of a millimeter as required by pyembroidery
-    scale = 10 / PIXELS_PER_MM
+def get_embroidery_pattern(stitch_plan, svg):
+    """Convert the stitch plan into a pyembroidery pattern.
 
-    origin = get_origin(svg, stitch_plan.bounding_box)
-    # origin = origin * scale
+    The pattern can be shared by all formats written from the same stitch plan.
+    """
 
     pattern = pyembroidery.EmbPattern()
 
@@ -78,6 +77,18 @@ def write_embroidery_file(file_path, stitch_plan, svg, settings={}):
 
     pattern.add_stitch_absolute(pyembroidery.END, stitch.x, stitch.y)
 
+    return pattern
+
+
+def get_write_settings(extension, stitch_plan, svg, settings=None):
+    # convert from pixels to millimeters
+    # also multiply by 10 to get tenths of a millimeter as required by pyembroidery
+    scale = 10 / PIXELS_PER_MM
+
+    origin = get_origin(svg, stitch_plan.bounding_box)
+    # origin = origin * scale
+
+    settings = dict(settings or {})
     settings.update({
         # correct for the origin
         "translate": -origin,
@@ -91,22 +102,70 @@ def write_embroidery_file(file_path, stitch_plan, svg, settings={}):
         "full_jump": True,
     })
 
-    if not file_path.endswith(('.col', '.edr', '.inf')):
+    if extension not in ('col', 'edr', 'inf'):
         settings['encode'] = True
 
-    if file_path.endswith('.csv'):
+    if extension == 'csv':
         # Special treatment for CSV: instruct pyembroidery not to do any post-
         # processing.  This will allow the user to match up stitch numbers seen
         # in the simulator with commands in the CSV.
         settings['max_stitch'] = float('inf')
         settings['max_jump'] = float('inf')
         settings['explicit_trim'] = False
-    elif file_path.endswith('.png'):
-        settings['linewidth'] = 1
-        settings['background'] = 'white'
+
+    return settings
+
+
+def get_writer(extension):
+    for file_format in pyembroidery.supported_formats():
+        if file_format['extension'] == extension and 'writer' in file_format:
+            return file_format['writer']
+
+    raise IOError("Conversion to file type '%s' is not supported" % extension)
+
+
+def write_embroidery(stream, extension, stitch_plan, svg, settings=None, pattern=None):
+    """Write the stitch plan into a binary stream.
+
+    Arguments:
+        stream -- a binary file-like object
+        extension -- the file extension of the format to write, e.g. "dst"
+        settings -- additional settings for pyembroidery
+        pattern -- the result of get_embroidery_pattern(), if the caller
+                   writes more than one format
+    """
+
+    if extension == 'png':
+        # pyembroidery draws PNG files one stitch at a time, this is much faster.
+        # pyembroidery draws one pixel per 0.1mm, so do the same.
+        from .svg.raster import render_stitch_plan_image
+
+        render_stitch_plan_image(stitch_plan, dpi=254).save(stream, "PNG")
+        return
+
+    if pattern is None:
+        pattern = get_embroidery_pattern(stitch_plan, svg)
+
+    writer = get_writer(extension)
+    settings = get_write_settings(extension, stitch_plan, svg, settings)
+
+    if getattr(writer, 'WRITE_FILE_IN_TEXT_MODE', False):
+        text_stream = io.TextIOWrapper(stream)
+        pyembroidery.write_embroidery(writer, pattern, text_stream, settings)
+        text_stream.flush()
+
+        # don't close the stream along with text_stream
+        text_stream.detach()
+    else:
+        pyembroidery.write_embroidery(writer, pattern, stream, settings)
+
+
+def write_embroidery_file(file_path, stitch_plan, svg, settings={}):
+    extension = os.path.splitext(file_path)[1][1:].lower()
 
     try:
-        pyembroidery.write(pattern, file_path, settings)
+        with open(file_path, 'wb') as output_file:
+            write_embroidery(output_file, extension, stitch_plan, svg, settings)
     except IOError as e:
         # L10N low-level file error.  %(error)s is (hopefully?) translated by
         # the user's system automatically.
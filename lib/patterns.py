@@ -3,20 +3,16 @@
 # Copyright (c) 2010 Authors
 # Licensed under the GNU GPL version 3.0 or later.  See the file LICENSE for details.
 
-from shapely import geometry as shgeo
+import numpy as np
+import shapely
 
-from .marker import get_marker_elements
+from .marker import get_marker_elements, get_marker_group
 from .stitch_plan import Stitch
 from .utils import Point
 
 
 def get_patterns_cache_key_data(node):
-    patterns = get_marker_elements(node, "pattern")
-    data = []
-    data.extend([fill.wkt for fill in patterns['fill']])
-    data.extend([stroke.wkt for stroke in patterns['stroke']])
-
-    return data
+    return get_marker_group(node, "pattern").get_cache_key(get_satins=False)
 
 
 def apply_patterns(stitch_groups, node):
@@ -27,52 +23,95 @@ def apply_patterns(stitch_groups, node):
 
 def _apply_stroke_patterns(patterns, stitch_groups):
     for pattern in patterns:
+        if pattern.is_empty:
+            continue
+
+        pattern_tree = shapely.STRtree(shapely.get_parts(pattern))
         for stitch_group in stitch_groups:
+            stitches = stitch_group.stitches
+            if len(stitches) < 2:
+                continue
+
+            pattern_points = _get_pattern_points(_stitch_coordinates(stitches), pattern, pattern_tree)
+            if not pattern_points:
+                continue
+
             stitch_group_points = []
-            for i, stitch in enumerate(stitch_group.stitches):
+            for i, stitch in enumerate(stitches):
                 stitch_group_points.append(stitch)
-                if i == len(stitch_group.stitches) - 1:
-                    continue
-                intersection_points = _get_pattern_points(stitch, stitch_group.stitches[i + 1], pattern)
-                for point in intersection_points:
+                for point in pattern_points.get(i, ()):
                     stitch_group_points.append(Stitch(point, tags=('pattern_point',)))
             stitch_group.stitches = stitch_group_points
 
 
 def _apply_fill_patterns(patterns, stitch_groups):
     for pattern in patterns:
+        shapely.prepare(pattern)
         for stitch_group in stitch_groups:
-            stitch_group_points = []
-            for i, stitch in enumerate(stitch_group.stitches):
-                if not shgeo.Point(stitch).within(pattern):
-                    # keep points outside the fill pattern
-                    stitch_group_points.append(stitch)
-                elif i - 1 < 0 or i >= len(stitch_group.stitches) - 1:
-                    # keep start and end points
-                    stitch_group_points.append(stitch)
-                elif stitch.has_tag('fill_row_start') or stitch.has_tag('fill_row_end'):
-                    # keep points if they are the start or end of a fill stitch row
-                    stitch_group_points.append(stitch)
-                elif stitch.has_tag('auto_fill') and not stitch.has_tag('auto_fill_top'):
-                    # keep auto-fill underlay
-                    stitch_group_points.append(stitch)
-                elif stitch.has_tag('auto_fill_travel'):
-                    # keep travel stitches (underpath or travel around the border)
-                    stitch_group_points.append(stitch)
-                elif stitch.has_tag('satin_column') and not stitch.has_tag('satin_split_stitch'):
-                    # keep satin column stitches unless they are split stitches
-                    stitch_group_points.append(stitch)
-            stitch_group.stitches = stitch_group_points
+            stitches = stitch_group.stitches
+            if not stitches:
+                continue
+
+            coordinates = _stitch_coordinates(stitches)
+            inside = shapely.contains_xy(pattern, coordinates[:, 0], coordinates[:, 1])
+            if not inside.any():
+                continue
+
+            last = len(stitches) - 1
+            stitch_group.stitches = [stitch for i, stitch in enumerate(stitches)
+                                     if not inside[i] or i == 0 or i == last or _keep_stitch_in_fill_pattern(stitch)]
+
+
+def _keep_stitch_in_fill_pattern(stitch):
+    if stitch.has_tag('fill_row_start') or stitch.has_tag('fill_row_end'):
+        # keep points if they are the start or end of a fill stitch row
+        return True
+    elif stitch.has_tag('auto_fill') and not stitch.has_tag('auto_fill_top'):
+        # keep auto-fill underlay
+        return True
+    elif stitch.has_tag('auto_fill_travel'):
+        # keep travel stitches (underpath or travel around the border)
+        return True
+    elif stitch.has_tag('satin_column') and not stitch.has_tag('satin_split_stitch'):
+        # keep satin column stitches unless they are split stitches
+        return True
+    return False
+
+
+def _stitch_coordinates(stitches):
+    return np.array([(stitch.x, stitch.y) for stitch in stitches], dtype=float)
+
+
+def _get_pattern_points(coordinates, pattern, pattern_tree):
+    """Find where the stitches cross a stroke pattern.
+
+    Returns:
+        a dict mapping the index of a stitch to the list of points where the
+        line to the next stitch crosses the pattern, sorted by their distance
+        to the stitch
+    """
+
+    segments = shapely.linestrings(np.stack((coordinates[:-1], coordinates[1:]), axis=1))
+
+    # Only intersect segments that come close to the pattern.  Intersecting
+    # with the whole pattern (not just the parts that the tree found) keeps
+    # points shared by two parts of the pattern from showing up twice.
+    candidates = np.unique(pattern_tree.query(segments, predicate='intersects')[0])
+    if len(candidates) == 0:
+        return {}
+    intersections = shapely.intersection(segments[candidates], pattern)
+
+    # Only points count, the pattern may also run along a stitch.
+    is_point = np.isin(shapely.get_type_id(intersections), (shapely.GeometryType.POINT, shapely.GeometryType.MULTIPOINT))
+    points, index = shapely.get_coordinates(intersections[is_point], return_index=True)
+    stitch_indices = candidates[is_point][index]
+
+    # sort points after their distance to the stitch
+    distances = np.hypot(*(points - coordinates[stitch_indices]).T)
+    order = np.lexsort((distances, stitch_indices))
 
+    pattern_points = {}
+    for stitch_index, (x, y) in zip(stitch_indices[order].tolist(), points[order].tolist()):
+        pattern_points.setdefault(stitch_index, []).append(Point(x, y))
 
-def _get_pattern_points(first, second, pattern):
-    points = []
-    intersection = shgeo.LineString([first, second]).intersection(pattern)
-    if isinstance(intersection, shgeo.Point):
-        points.append(Point(intersection.x, intersection.y))
-    if isinstance(intersection, shgeo.MultiPoint):
-        for point in intersection.geoms:
-            points.append(Point(point.x, point.y))
-    # sort points after their distance to first
-    points.sort(key=lambda point: point.distance(first))
-    return points
+    return pattern_points
@@ -8,4 +8,5 @@ from .generate_stitch_plan import generate_stitch_plan
 from .read_file import stitch_plan_from_file
 from .stitch import Stitch
 from .stitch_group import StitchGroup
-from .stitch_plan import StitchPlan, stitch_groups_to_stitch_plan
+from .stitch_plan import (StitchPlan, stitch_groups_to_color_blocks,
+                          stitch_groups_to_stitch_plan)
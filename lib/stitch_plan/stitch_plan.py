@@ -3,6 +3,7 @@
 # Copyright (c) 2010 Authors
 # Licensed under the GNU GPL version 3.0 or later.  See the file LICENSE for details.
 
+from itertools import chain
 from sys import exit
 from typing import List
 
@@ -15,8 +16,7 @@ from ..utils.threading import check_stop_flag
 from .color_block import ColorBlock
 
 
-def stitch_groups_to_stitch_plan(stitch_groups, collapse_len=None, min_stitch_len=0.1, disable_ties=False):  # noqa: C901
-
+def stitch_groups_to_stitch_plan(stitch_groups, collapse_len=None, min_stitch_len=0.1, disable_ties=False):
     """Convert a collection of StitchGroups to a StitchPlan.
 
     * applies instructions embedded in the StitchGroup such as trim_after and stop_after
@@ -24,17 +24,35 @@ def stitch_groups_to_stitch_plan(stitch_groups, collapse_len=None, min_stitch_le
     * adds jump-stitches between stitch_group if necessary
     """
 
-    if not stitch_groups:
+    stitch_plan = StitchPlan()
+    for color_block in stitch_groups_to_color_blocks(stitch_groups, collapse_len, min_stitch_len, disable_ties):
+        stitch_plan.add_color_block(color_block)
+
+    return stitch_plan
+
+
+def stitch_groups_to_color_blocks(stitch_groups, collapse_len=None, min_stitch_len=0.1, disable_ties=False):  # noqa: C901
+    """Generate the ColorBlocks of a stitch plan one at a time.
+
+    This works like stitch_groups_to_stitch_plan(), but stitch_groups may be
+    any iterable, including a generator.  Each ColorBlock is yielded as soon as
+    the next color starts, so callers can use it while the remaining
+    StitchGroups are still being generated.
+    """
+
+    stitch_groups = iter(stitch_groups)
+    first_stitch_group = next(stitch_groups, None)
+    if first_stitch_group is None:
         errormsg(_("There is no selected stitchable element. Please run "
                    "Extensions > Ink/Stitch > Troubleshoot > Troubleshoot objects in case you have expected a stitchout."))
         exit(1)
+    stitch_groups = chain([first_stitch_group], stitch_groups)
 
     if collapse_len is None:
         collapse_len = 3.0
     collapse_len = float(collapse_len) * PIXELS_PER_MM
 
-    stitch_plan = StitchPlan()
-    color_block = stitch_plan.new_color_block(color=stitch_groups[0].color)
+    color_block = ColorBlock(color=first_stitch_group.color)
 
     previous_stitch_group = None
     need_tie_in = True
@@ -55,9 +73,11 @@ def stitch_groups_to_stitch_plan(stitch_groups, collapse_len=None, min_stitch_le
 
             # end the previous block with a color change
             color_block.add_stitch(color_change=True)
+            color_block.filter_duplicate_stitches(min_stitch_len)
+            yield color_block
 
             # make a new block of our color
-            color_block = stitch_plan.new_color_block(color=stitch_group.color)
+            color_block = ColorBlock(color=stitch_group.color)
         else:
             if (len(color_block) and not need_tie_in and
                     ((stitch_group.stitches[0] - color_block.stitches[-1]).length() > collapse_len or
@@ -98,13 +118,10 @@ def stitch_groups_to_stitch_plan(stitch_groups, collapse_len=None, min_stitch_le
         if lock_stitches:
             color_block.add_stitches(stitches=lock_stitches)
 
-    if len(color_block) == 0:
-        # last block ended in a stop, so now we have an empty block
-        del stitch_plan.color_blocks[-1]
-
-    stitch_plan.filter_duplicate_stitches(min_stitch_len)
-
-    return stitch_plan
+    if len(color_block) > 0:
+        # if the last block ended in a stop, we'd have an empty block here
+        color_block.filter_duplicate_stitches(min_stitch_len)
+        yield color_block
 
 
 class StitchPlan(object):
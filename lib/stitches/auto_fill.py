@@ -20,7 +20,8 @@ from ..svg import PIXELS_PER_MM
 from ..utils import cache
 from ..utils.clamp_path import clamp_path_to_polygon
 from ..utils.geometry import Point as InkstitchPoint
-from ..utils.geometry import (ensure_multi_line_string,
+from ..utils.geometry import (coordinate_list_to_point_list,
+                              ensure_multi_line_string,
                               line_string_to_point_list)
 from ..utils.smoothing import smooth_path
 from ..utils.threading import check_stop_flag
@@ -667,7 +668,7 @@ def travel(shape, travel_graph, edge, running_stitch_length, running_stitch_tole
     start, end = edge
     path = networkx.shortest_path(travel_graph, start, end, weight='weight')
     if underpath and path != (start, end):
-        path = smooth_path(path, 2)
+        path = coordinate_list_to_point_list(smooth_path(path, 2))
     else:
         path = [InkstitchPoint.from_tuple(point) for point in path]
     if len(path) > 1:
@@ -7,8 +7,10 @@ from collections import defaultdict
 
 import inkex
 import networkx as nx
-from shapely.geometry import LineString, MultiLineString, MultiPoint, Point
-from shapely.ops import nearest_points, substring, unary_union
+import numpy as np
+import shapely
+from shapely.geometry import MultiLineString, Point
+from shapely.ops import unary_union
 
 from ..commands import add_commands
 from ..elements import Stroke
@@ -30,7 +32,7 @@ class LineSegments:
     Attributes:
         _lines   -- a list of LineStrings from the subpaths of the Stroke elements
         _elements -- a list of Stroke elements for each corresponding line in _lines
-        _intersection_points -- a dictionary with intersection points {line_index: [intersection_points]}
+        _intersection_points -- a dictionary with intersection point coordinates {line_index: [intersection_points]}
         segments -- (public) a list of segments and corresponding elements [[segment, element], ...]
     '''
 
@@ -62,35 +64,38 @@ class LineSegments:
                 check_stop_flag()
 
     def _get_intersection_points(self):
-        for i, line1 in enumerate(self._lines):
-            for j in range(i + 1, len(self._lines)):
-                check_stop_flag()
+        # Only lines that come within 50px of each other need a closer look.
+        tree = shapely.STRtree(self._lines)
+        lines1, lines2 = tree.query(self._lines, predicate='dwithin', distance=50)
+        pairs = lines1 < lines2
+        lines1 = lines1[pairs]
+        lines2 = lines2[pairs]
 
-                line2 = self._lines[j]
-                distance = line1.distance(line2)
-                if distance > 50:
-                    continue
-                if not distance == 0:
-                    # add nearest points
-                    near = nearest_points(line1, line2)
-                    self._add_point(i, near[0])
-                    self._add_point(j, near[1])
-                # add intersections
-                intersections = line1.intersection(line2)
-                if isinstance(intersections, Point):
-                    self._add_point(i, intersections)
-                    self._add_point(j, intersections)
-                elif isinstance(intersections, MultiPoint):
-                    for point in intersections.geoms:
-                        self._add_point(i, point)
-                        self._add_point(j, point)
-                elif isinstance(intersections, LineString):
-                    for point in intersections.coords:
-                        self._add_point(i, Point(*point))
-                        self._add_point(j, Point(*point))
-
-    def _add_point(self, element, point):
-        self._intersection_points[element].append(point)
+        check_stop_flag()
+
+        geoms = tree.geometries
+        distances = shapely.distance(geoms[lines1], geoms[lines2])
+
+        # add nearest points for lines that don't touch
+        apart = distances > 0
+        nearest = shapely.get_coordinates(shapely.shortest_line(geoms[lines1[apart]], geoms[lines2[apart]])).reshape((-1, 2, 2))
+        self._add_points(lines1[apart], nearest[:, 0])
+        self._add_points(lines2[apart], nearest[:, 1])
+
+        check_stop_flag()
+
+        # add intersections
+        touching = ~apart
+        intersections = shapely.intersection(geoms[lines1[touching]], geoms[lines2[touching]])
+        types = shapely.get_type_id(intersections)
+        usable = np.isin(types, (shapely.GeometryType.POINT, shapely.GeometryType.MULTIPOINT, shapely.GeometryType.LINESTRING))
+        points, index = shapely.get_coordinates(intersections[usable], return_index=True)
+        self._add_points(lines1[touching][usable][index], points)
+        self._add_points(lines2[touching][usable][index], points)
+
+    def _add_points(self, line_indices, points):
+        for line_index, point in zip(line_indices.tolist(), points):
+            self._intersection_points[line_index].append(point)
 
     def _get_segments(self):
         '''
@@ -98,7 +103,7 @@ class LineSegments:
         The split method would make this very easy (it can split a MultiString with
         MultiPoints) but sadly it fails too often, while snap moves the points away
         from where we want them.  So we need to calculate the distance along the line
-        and finally split it into segments with shapelys substring method.
+        and finally split it into segments like shapely's substring method would.
         '''
         self.segments = []
         for i, line in enumerate(self._lines):
@@ -106,17 +111,51 @@ class LineSegments:
             points = self._intersection_points[i]
 
             distances = [0, length]
-            for point in points:
-                distances.append(line.project(point))
-            distances = sorted(set(distances))
+            if points:
+                distances.extend(shapely.line_locate_point(line, shapely.points(points)).tolist())
+            distances = np.array(sorted(set(distances)))
+
+            for seg in _split_line(line, distances):
+                self.segments.append([seg, self._elements[i]])
+
+
+def _split_line(line, distances):
+    """Cut a line into pieces between consecutive distances along it.
+
+    This gives the same result as calling shapely.ops.substring() for each
+    pair of consecutive distances, but handles all pieces at once.  Pieces of
+    0.1 or less are skipped.
+
+    Arguments:
+        line -- a LineString
+        distances -- a sorted numpy array of distances along the line
+    """
+
+    starts = distances[:-1]
+    ends = distances[1:]
+    keep = ends - starts > 0.1
+    starts = starts[keep]
+    ends = ends[keep]
+    if len(starts) == 0:
+        return []
+
+    coords = shapely.get_coordinates(line)
+    vertex_distances = np.concatenate(([0], np.cumsum(np.sqrt(np.sum(np.diff(coords, axis=0) ** 2, axis=1)))))
+
+    start_points = shapely.get_coordinates(shapely.line_interpolate_point(line, starts))
+    end_points = shapely.get_coordinates(shapely.line_interpolate_point(line, ends))
+
+    # the vertices strictly between each start and end
+    first_vertices = np.searchsorted(vertex_distances, np.maximum(starts, 0), side='right')
+    last_vertices = np.searchsorted(vertex_distances, ends, side='left')
 
-            for j in range(len(distances) - 1):
-                start = distances[j]
-                end = distances[j + 1]
+    piece_coords = []
+    piece_indices = []
+    for piece, (start_point, first, last, end_point) in enumerate(zip(start_points, first_vertices, last_vertices, end_points)):
+        piece_coords.extend((start_point[np.newaxis], coords[first:last], end_point[np.newaxis]))
+        piece_indices.append(np.full(last - first + 2, piece))
 
-                if end - start > 0.1:
-                    seg = substring(line, start, end)
-                    self.segments.append([seg, self._elements[i]])
+    return list(shapely.linestrings(np.concatenate(piece_coords), indices=np.concatenate(piece_indices)))
 
 
 def autorun(elements, preserve_order=False, break_up=None, starting_point=None, ending_point=None, trim=False):
@@ -3,12 +3,13 @@ from itertools import chain
 
 import networkx as nx
 import numpy as np
-import trimesh
+import shapely
 from shapely import offset_curve
 from shapely.geometry import (GeometryCollection, LineString, MultiPolygon,
-                              Point, Polygon)
+                              Polygon)
 from shapely.geometry.polygon import orient
-from shapely.ops import nearest_points, polygonize
+from shapely.ops import polygonize
+from shapely.strtree import STRtree
 from shapely.validation import make_valid
 
 from ..stitch_plan import Stitch
@@ -49,13 +50,27 @@ nearest_neighbor_tuple = namedtuple(
 )
 
 
-def _offset_linear_ring(ring, offset, resolution, join_style, mitre_limit):
-    ring = Polygon(ring)
-    result = offset_curve(ring, -offset, resolution, join_style=join_style, mitre_limit=mitre_limit)
-    result = ensure_multi_line_string(result)
-    rings = result.simplify(0.01, False)
+def _offset_linear_rings(rings, offsets, resolution, join_style, mitre_limit):
+    """Offset several rings inward in a single batched shapely call.
 
-    return _take_only_valid_linear_rings(rings)
+    Arguments:
+        rings - a list of LinearRings
+        offsets - a list of offsets, one per ring.  Positive values shrink
+                  the ring and negative values grow it.
+
+    Return value:
+        a list of GeometryCollections of valid rings, one per input ring
+    """
+
+    polygons = [Polygon(ring) for ring in rings]
+    results = offset_curve(polygons, -np.asarray(offsets), quad_segs=resolution, join_style=join_style, mitre_limit=mitre_limit)
+
+    offset_rings = []
+    for result in results:
+        result = ensure_multi_line_string(result)
+        offset_rings.append(_take_only_valid_linear_rings(result.simplify(0.01, preserve_topology=False)))
+
+    return offset_rings
 
 
 def _take_only_valid_linear_rings(rings):
@@ -121,7 +136,9 @@ def offset_polygon(polygon, offset, join_style, clockwise):
         clockwise - If True, isocontour points are in clockwise order; if False, counter-clockwise.
 
     Return Value:
-        Tree - see above
+        Tree - see above.  Each node's val is the isocontour as a shapely
+               LinearRing.  The strategies only read the rings, so one tree
+               can be used for inner-to-outer, single and double spiral.
     """
 
     ordered_polygon = orient(polygon, -1)
@@ -144,9 +161,10 @@ def offset_polygon(polygon, offset, join_style, clockwise):
         outer, inners = _offset_polygon_and_holes(tree, current_poly, current_holes, offset, join_style)
 
         polygons = _match_polygons_and_holes(outer, inners)
+        child_hole_index = _build_hole_index(tree, current_holes)
 
         for polygon in polygons.geoms:
-            new_polygon, new_holes = _convert_polygon_to_nodes(tree, polygon, parent_polygon=current_poly, child_holes=current_holes)
+            new_polygon, new_holes = _convert_polygon_to_nodes(tree, polygon, parent_polygon=current_poly, child_hole_index=child_hole_index)
 
             if new_polygon is not None:
                 active_polygons.append(new_polygon)
@@ -166,23 +184,20 @@ def offset_polygon(polygon, offset, join_style, clockwise):
 
 
 def _offset_polygon_and_holes(tree, poly, holes, offset, join_style):
-    outer = _offset_linear_ring(
-        tree.nodes[poly].val,
-        offset,
+    # The outer ring and all of its holes are offset together in one call.
+    # Holes take a negative offset so that they grow instead of shrinking.
+    rings = [tree.nodes[poly].val] + [tree.nodes[hole].val for hole in holes]
+    offsets = [offset] + [-offset] * len(holes)
+    outer, *offset_holes = _offset_linear_rings(
+        rings,
+        offsets,
         resolution=5,
         join_style=join_style,
         mitre_limit=10,
     )
 
     inners = []
-    for hole in holes:
-        inner = _offset_linear_ring(
-            tree.nodes[hole].val,
-            -offset,  # take negative offset for holes
-            resolution=5,
-            join_style=join_style,
-            mitre_limit=10,
-        )
+    for inner in offset_holes:
         if not inner.is_empty:
             inners.append(Polygon(inner.geoms[0]))
 
@@ -200,7 +215,18 @@ def _match_polygons_and_holes(outer, inners):
     return result
 
 
-def _convert_polygon_to_nodes(tree, polygon, parent_polygon, child_holes):
+def _build_hole_index(tree, holes):
+    """Build a spatial index to quickly find which holes a new hole contains.
+
+    Return value:
+        tuple of (list of hole nodes, STRtree of the holes as Polygons)
+    """
+
+    hole_polygons = [Polygon(tree.nodes[hole].val) for hole in holes]
+    return holes, STRtree(hole_polygons)
+
+
+def _convert_polygon_to_nodes(tree, polygon, parent_polygon, child_hole_index):
     if polygon.area < 0.1:
         return None, None
 
@@ -217,52 +243,59 @@ def _convert_polygon_to_nodes(tree, polygon, parent_polygon, child_holes):
     tree.add_node(node, type='node', parent=parent_polygon, val=exterior)
     tree.add_edge(parent_polygon, node)
 
+    child_holes, child_hole_tree = child_hole_index
     hole_nodes = []
     for hole in polygon.interiors:
         hole_node = tree.generate_node_name()
         tree.add_node(hole_node, type="hole", val=hole)
-        for previous_hole in child_holes:
-            if Polygon(hole).contains(Polygon(tree.nodes[previous_hole].val)):
-                tree.nodes[previous_hole].parent = hole_node
-                tree.add_edge(hole_node, previous_hole)
+        for index in sorted(child_hole_tree.query(Polygon(hole), predicate='contains')):
+            previous_hole = child_holes[index]
+            tree.nodes[previous_hole].parent = hole_node
+            tree.add_edge(hole_node, previous_hole)
         hole_nodes.append(hole_node)
 
     return node, hole_nodes
 
 
-def _get_nearest_points_closer_than_thresh(travel_line, next_line, threshold):
+def _get_nearest_points_closer_than_thresh(travel_line, next_lines, threshold):
     """
-    Find the first point along travel_line that is within threshold of next_line.
+    Find the first point along travel_line that is within threshold of each of next_lines.
 
     Input:
         travel_line - The "parent" line for which the distance should
-                      be minimized to enter next_line
-        next_line - contains the next_line which need to be entered
-        threshold - The distance between travel_line and next_line needs
+                      be minimized to enter next_lines
+        next_lines - a numpy array of the lines which need to be entered
+        threshold - The distance between travel_line and a next_line needs
                     to below threshold to be a valid point for entering
 
     Return value:
-        tuple or None
-            - the tuple structure is:
-              (point in travel_line, point in next_line)
-            - None is returned if there is no point that satisfies the threshold.
+        numpy array of LineStrings or None, one per line in next_lines
+            - each LineString goes from the point in travel_line to the
+              point in the respective next_line
+            - None indicates that there is no point that satisfies the
+              threshold for that line
     """
 
-    # We'll buffer next_line and find the intersection with travel_line.
-    # Then we'll return the very first point in the intersection,
-    # matched with a corresponding point on next_line.  Fortunately for
-    # us, intersection of a Polygon with a LineString yields pieces of
-    # the LineString in the same order as the input LineString.
-    threshold_area = next_line.buffer(threshold)
-    portion_within_threshold = travel_line.intersection(threshold_area)
-
-    if portion_within_threshold.is_empty:
-        return None
-    else:
+    # We'll buffer each next_line and find the intersection with travel_line.
+    # Then we'll use the very first point in the intersection, matched with a
+    # corresponding point on next_line.  Fortunately for us, intersection of
+    # a Polygon with a LineString yields pieces of the LineString in the same
+    # order as the input LineString.
+    #
+    # All of this is done for all lines at once, because a parent ring can have
+    # a lot of children in large shapes.
+    threshold_areas = shapely.buffer(next_lines, threshold, quad_segs=16)
+    portions_within_threshold = shapely.intersection(travel_line, threshold_areas)
+
+    connections = np.full(len(next_lines), None, dtype=object)
+    found = ~shapely.is_empty(portions_within_threshold)
+    if found.any():
         # Projecting with 0 lets us avoid distinguishing between LineString and
         # MultiLineString.
-        parent_point = Point(portion_within_threshold.interpolate(0))
-        return nearest_points(parent_point, next_line)
+        parent_points = shapely.line_interpolate_point(portions_within_threshold[found], 0)
+        connections[found] = shapely.shortest_line(parent_points, next_lines[found])
+
+    return connections
 
 
 def _create_nearest_points_list(travel_line, tree, children, threshold, threshold_hard):
@@ -282,25 +315,35 @@ def _create_nearest_points_list(travel_line, tree, children, threshold, threshol
                                          respective child
     """
 
-    children_nearest_points = []
+    children = list(children)
+    if not children:
+        return []
+
+    child_lines = np.array([tree.nodes[child].val for child in children], dtype=object)
+    connections = _get_nearest_points_closer_than_thresh(travel_line, child_lines, threshold)
+
+    missing = shapely.is_missing(connections)
+    if missing.any():
+        # where holes meet outer borders a distance
+        # up to 2 * used offset can arise
+        connections[missing] = _get_nearest_points_closer_than_thresh(travel_line, child_lines[missing], threshold_hard)
 
-    for child in children:
-        result = _get_nearest_points_closer_than_thresh(travel_line, tree.nodes[child].val, threshold)
-        if result is None:
-            # where holes meet outer borders a distance
-            # up to 2 * used offset can arise
-            result = _get_nearest_points_closer_than_thresh(travel_line, tree.nodes[child].val, threshold_hard)
+    # if we still didn't get a result, ignore this child
+    # this may lead to oddities, but at least it doesn't fail
+    found = ~shapely.is_missing(connections)
+    connections = connections[found]
+    found_children = [child for child, child_found in zip(children, found) if child_found]
 
-        # if we still didn't get a result, ignore this child
-        # this may lead to oddities, but at least it doesn't fail
-        if result is None:
-            continue
+    parent_points = shapely.get_point(connections, 0)
+    child_points = shapely.get_point(connections, 1)
+    projections = shapely.line_locate_point(travel_line, parent_points)
 
-        proj = travel_line.project(result[0])
+    children_nearest_points = []
+    for parent_point, child_point, proj, child in zip(parent_points, child_points, projections, found_children):
         children_nearest_points.append(
             nearest_neighbor_tuple(
-                nearest_point_parent=result[0],
-                nearest_point_child=result[1],
+                nearest_point_parent=parent_point,
+                nearest_point_child=child_point,
                 proj_distance_parent=proj,
                 child_node=child,
             )
@@ -317,7 +360,8 @@ def _find_path_inner_to_outer(tree, node, offset, starting_point, avoid_self_cro
     from inner to outer.
 
     This function calls itself recursively to find a stitch path for each child
-    (and its children).
+    (and its children).  The tree is not modified, so the same tree can be
+    used to generate several paths.
 
     Arguments:
         tree - a Tree of isocontours (as returned by offset_polygon)
@@ -329,12 +373,11 @@ def _find_path_inner_to_outer(tree, node, offset, starting_point, avoid_self_cro
                   (used internally by avoid_self_crossing)
 
     Return value:
-        LineString -- the stitching path
+        list of numpy arrays -- the pieces of the stitching path in order
     """
     check_stop_flag()
 
-    current_node = tree.nodes[node]
-    current_ring = current_node.val
+    current_ring = tree.nodes[node].val
 
     if not forward and avoid_self_crossing:
         current_ring = reverse_line_string(current_ring)
@@ -343,7 +386,6 @@ def _find_path_inner_to_outer(tree, node, offset, starting_point, avoid_self_cro
     # a point nearest the starting_point
     start_distance = current_ring.project(starting_point)
     current_ring = roll_linear_ring(current_ring, start_distance)
-    current_node.val = current_ring
 
     # Find where along this ring to connect to each child.
     nearest_points_list = _create_nearest_points_list(
@@ -355,6 +397,10 @@ def _find_path_inner_to_outer(tree, node, offset, starting_point, avoid_self_cro
     )
     nearest_points_list.sort(key=lambda tup: tup.proj_distance_parent)
 
+    # We collect the pieces of the path as coordinate arrays and only join
+    # them at the very end.  Building a LineString at every level of the
+    # recursion copies the coordinates of all inner rings over and over again,
+    # which is very slow for shapes with a lot of rings.
     result_coords = []
     if not nearest_points_list:
         # We have no children, so we're at the center of a spiral.  Reversing
@@ -366,7 +412,7 @@ def _find_path_inner_to_outer(tree, node, offset, starting_point, avoid_self_cro
         # to jump to each child ring in turn and sew it before continuing on
         # this ring.  We'll end back where we started.
 
-        result_coords.append(current_ring.coords[0])
+        result_coords.append(shapely.get_coordinates(current_ring)[:1])
         distance_so_far = 0
         for child_connection in nearest_points_list:
             # Cut this ring into pieces before and after where this child will connect.
@@ -375,7 +421,7 @@ def _find_path_inner_to_outer(tree, node, offset, starting_point, avoid_self_cro
 
             # Stitch the part leading up to this child.
             if before is not None:
-                result_coords.extend(before.coords)
+                result_coords.append(shapely.get_coordinates(before))
 
             # Stitch this child.  The child will start and end in the same
             # place, which should be close to our current location.
@@ -387,7 +433,7 @@ def _find_path_inner_to_outer(tree, node, offset, starting_point, avoid_self_cro
                 avoid_self_crossing,
                 not forward
             )
-            result_coords.extend(child_path.coords)
+            result_coords.extend(child_path)
 
             # Skip ahead a little bit on this ring before resuming.  This
             # gives a nice spiral pattern, where we spiral out from the
@@ -404,20 +450,21 @@ def _find_path_inner_to_outer(tree, node, offset, starting_point, avoid_self_cro
         if remaining_length > offset:
             current_ring, skip = cut(current_ring, current_ring.length - offset)
 
-        result_coords.extend(current_ring.coords)
+        result_coords.append(shapely.get_coordinates(current_ring))
 
-    return LineString(result_coords)
+    return result_coords
 
 
 def inner_to_outer(tree, polygon, offset, stitch_length, tolerance, smoothness, starting_point, avoid_self_crossing):
     """Fill a shape with spirals, from innermost to outermost."""
 
-    stitch_path = _find_path_inner_to_outer(tree, 'root', offset, starting_point, avoid_self_crossing)
-    points = [Stitch(*point) for point in stitch_path.coords]
+    stitch_path = np.concatenate(_find_path_inner_to_outer(tree, 'root', offset, starting_point, avoid_self_crossing))
 
     if smoothness > 0:
-        smoothed = smooth_path(points, smoothness)
+        smoothed = smooth_path(stitch_path, smoothness, use_cache=True)
         points = clamp_path_to_polygon(smoothed, polygon)
+    else:
+        points = [Stitch(*point) for point in stitch_path.tolist()]
 
     stitches = running_stitch(points, stitch_length, tolerance)
 
@@ -456,6 +503,9 @@ def _interpolate_linear_rings(ring1, ring2, max_stitch_length, start=None):
     # This is a little less accurate than the method in interpolate(), but several
     # orders of magnitude faster because we're not building and querying a KDTree.
 
+    # trimesh takes a long time to import, and only this fill method needs it
+    import trimesh
+
     num_points = int(20 * ring1.length / max_stitch_length)
     ring1_resampled = trimesh.path.traversal.resample_path(np.array(ring1.coords), count=num_points)
     ring2_resampled = trimesh.path.traversal.resample_path(np.array(ring2.coords), count=num_points)
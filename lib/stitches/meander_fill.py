@@ -1,5 +1,3 @@
-from itertools import combinations
-
 import networkx as nx
 from shapely.geometry import LineString, MultiPoint, Point
 from shapely.ops import nearest_points
@@ -8,13 +6,14 @@ from .. import tiles
 from ..debug import debug
 from ..i18n import _
 from ..utils.clamp_path import clamp_path_to_polygon
-from ..utils.geometry import Point as InkStitchPoint
-from ..utils.geometry import ensure_geometry_collection
+from ..utils.geometry import (coordinate_list_to_point_list,
+                              ensure_geometry_collection)
 from ..utils.list import poprandom
 from ..utils.prng import iter_uniform_floats
 from ..utils.smoothing import smooth_path
 from ..utils.threading import check_stop_flag
 from .running_stitch import bean_stitch, running_stitch, zigzag_stitch
+from .utils.connections import shortest_connections
 
 
 def meander_fill(fill, shape, original_shape, shape_index, starting_point, ending_point):
@@ -52,19 +51,9 @@ def get_tile(tile_id):
 def ensure_connected(graph):
     """If graph is unconnected, add edges to make it connected."""
 
-    # TODO: combine this with possible_jumps() in lib/stitches/utils/autoroute.py
-    possible_connections = []
-    for component1, component2 in combinations(nx.connected_components(graph), 2):
-        points1 = MultiPoint([Point(node) for node in component1])
-        points2 = MultiPoint([Point(node) for node in component2])
-
-        start_point, end_point = nearest_points(points1, points2)
-        possible_connections.append(((start_point.x, start_point.y), (end_point.x, end_point.y), start_point.distance(end_point)))
-
-    if possible_connections:
-        for start, end in nx.k_edge_augmentation(graph, 1, avail=possible_connections):
-            check_stop_flag()
-            graph.add_edge(start, end)
+    # graph nodes are coordinate tuples
+    for start, end, distance in shortest_connections(nx.connected_components(graph), lambda node: node):
+        graph.add_edge(start, end)
 
 
 def find_starting_and_ending_nodes(graph, shape, starting_point, ending_point):
@@ -107,76 +96,197 @@ def generate_meander_path(graph, start, end, rng):
     path = find_initial_path(graph, start, end)
     path_edges = list(zip(path[:-1], path[1:]))
     graph.remove_edges_from(path_edges)
-    graph_nodes = set(graph) - set(path)
+
+    meander_graph = MeanderGraph(graph, path)
+    path_edges = meander_graph.to_indices(path_edges)
 
     edges_to_consider = list(path_edges)
-    meander_path = path_edges
+    meander_path = MeanderPath(path_edges)
     while edges_to_consider:
         while edges_to_consider:
             check_stop_flag()
 
             edge = poprandom(edges_to_consider, rng)
-            edges_to_consider.extend(replace_edge(meander_path, edge, graph, graph_nodes))
+            edges_to_consider.extend(replace_edge(meander_path, edge, meander_graph))
 
-        edge_pairs = list(zip(meander_path[:-1], meander_path[1:]))
+        edge_pairs = list(meander_path.edge_pairs())
         while edge_pairs:
             check_stop_flag()
 
             edge1, edge2 = poprandom(edge_pairs, rng)
-            new_edges = replace_edge_pair(meander_path, edge1, edge2, graph, graph_nodes)
+            new_edges = replace_edge_pair(meander_path, edge1, edge2, meander_graph)
             if new_edges:
                 edges_to_consider.extend(new_edges)
                 break
 
-    debug.log_graph(graph, "remaining graph", "#FF0000")
-    points = path_to_points(meander_path)
+    debug.log_graph(lambda: meander_graph.to_graph(), "remaining graph", "#FF0000")
+    points = path_to_points(meander_graph.to_nodes(meander_path))
     debug.log_line_string(LineString(points), "meander path", "#00FF00")
 
     return points
 
 
-def replace_edge(path, edge, graph, graph_nodes):
-    subgraph = graph.subgraph(graph_nodes | set(edge))
-    new_path = None
-    for new_path in nx.all_simple_edge_paths(subgraph, edge[0], edge[1], 7):
-        if len(new_path) > 1:
-            break
-    if new_path is None or len(new_path) == 1:
+def replace_edge(path, edge, graph):
+    new_path = graph.find_detour(edge[0], edge[1], cutoff=7, min_edges=2)
+    if new_path is None:
         return []
-    i = path.index(edge)
-    path[i:i + 1] = new_path
-    graph.remove_edges_from(new_path)
-    # do I need to remove the last one too?
-    graph_nodes.difference_update(start for start, end in new_path)
-    # debug.log(f"found new path of length {len(new_path)} at position {i}")
+    path.replace(edge, edge, new_path)
+    graph.remove_path(new_path)
+    # debug.log(f"found new path of length {len(new_path)}")
 
     return new_path
 
 
-def replace_edge_pair(path, edge1, edge2, graph, graph_nodes):
-    subgraph = graph.subgraph(graph_nodes | {edge1[0], edge2[1]})
-    new_path = None
-    for new_path in nx.all_simple_edge_paths(subgraph, edge1[0], edge2[1], 10):
-        if len(new_path) > 2:
-            break
-    if new_path is None or len(new_path) <= 2:
+def replace_edge_pair(path, edge1, edge2, graph):
+    new_path = graph.find_detour(edge1[0], edge2[1], cutoff=10, min_edges=3)
+    if new_path is None:
         return []
-    i = path.index(edge1)
-    path[i:i + 2] = new_path
-    graph.remove_edges_from(new_path)
-    # do I need to remove the last one too?
-    graph_nodes.difference_update(start for start, end in new_path)
-    # debug.log(f"found new pair path of length {len(new_path)} at position {i}")
+    path.replace(edge1, edge2, new_path)
+    graph.remove_path(new_path)
+    # debug.log(f"found new pair path of length {len(new_path)}")
 
     return new_path
 
 
+class MeanderGraph:
+    """The part of the meander graph that is not yet used by the path.
+
+    Nodes are numbered so that we can work with plain integers and lists
+    instead of hashing coordinate tuples over and over again.  The neighbors
+    of each node are kept in a dict, which preserves the order of the
+    original graph's adjacency and lets us remove edges in O(1).
+    """
+
+    def __init__(self, graph, path):
+        self.nodes = list(graph)
+        self.node_indices = {node: i for i, node in enumerate(self.nodes)}
+        self.adjacency = [dict.fromkeys(self.node_indices[neighbor] for neighbor in graph.adj[node]) for node in self.nodes]
+
+        # Nodes that the meander path hasn't visited yet.  A detour may only
+        # pass through these.
+        self.available = [True] * len(self.nodes)
+        for node in path:
+            self.available[self.node_indices[node]] = False
+
+    def to_indices(self, edges):
+        return [(self.node_indices[start], self.node_indices[end]) for start, end in edges]
+
+    def to_nodes(self, edges):
+        return [(self.nodes[start], self.nodes[end]) for start, end in edges]
+
+    def to_graph(self):
+        graph = nx.Graph()
+        for node, neighbors in enumerate(self.adjacency):
+            graph.add_edges_from((self.nodes[node], self.nodes[neighbor]) for neighbor in neighbors)
+
+        return graph
+
+    def find_detour(self, start, end, cutoff, min_edges):
+        """Find a path from start to end through unvisited nodes.
+
+        This is a depth-first search that visits neighbors in the same order
+        as nx.all_simple_edge_paths() would and returns the first path that
+        has at least min_edges and at most cutoff edges.
+
+        Return value:
+            a list of edges, or None if there is no such path
+        """
+
+        path_nodes = [start]
+        on_path = {start}
+        stack = [iter(self.adjacency[start])]
+
+        while stack:
+            next_node = None
+            for neighbor in stack[-1]:
+                if neighbor not in on_path and (self.available[neighbor] or neighbor == end):
+                    next_node = neighbor
+                    break
+
+            if next_node is None:
+                stack.pop()
+                on_path.discard(path_nodes.pop())
+                continue
+
+            if next_node == end:
+                if len(path_nodes) >= min_edges:
+                    path_nodes.append(end)
+                    return list(zip(path_nodes[:-1], path_nodes[1:]))
+            elif len(path_nodes) < cutoff:
+                path_nodes.append(next_node)
+                on_path.add(next_node)
+                stack.append(iter(self.adjacency[next_node]))
+
+        return None
+
+    def remove_path(self, edges):
+        for start, end in edges:
+            del self.adjacency[start][end]
+            del self.adjacency[end][start]
+            self.available[start] = False
+
+
+class MeanderPath:
+    """The meander path, stored as a doubly-linked list of edges.
+
+    Edges can't occur twice in the path, so each edge identifies its own
+    position.  That lets us splice a detour in place of one or two edges in
+    constant time instead of searching for them in a list.
+    """
+
+    def __init__(self, edges):
+        self.first = None
+        self.next = {}
+        self.previous = {}
+        self._link(None, edges, None)
+
+    def __iter__(self):
+        edge = self.first
+        while edge is not None:
+            yield edge
+            edge = self.next[edge]
+
+    def edge_pairs(self):
+        edges = iter(self)
+        previous_edge = next(edges, None)
+        for edge in edges:
+            yield previous_edge, edge
+            previous_edge = edge
+
+    def replace(self, first_edge, last_edge, new_edges):
+        """Replace the edges from first_edge through last_edge with new_edges."""
+
+        before = self.previous[first_edge]
+        after = self.next[last_edge]
+
+        edge = first_edge
+        while edge != after:
+            next_edge = self.next.pop(edge)
+            del self.previous[edge]
+            edge = next_edge
+
+        self._link(before, new_edges, after)
+
+    def _link(self, before, edges, after):
+        for edge in edges:
+            self.previous[edge] = before
+            if before is None:
+                self.first = edge
+            else:
+                self.next[before] = edge
+            before = edge
+
+        self.next[before] = after
+        if after is not None:
+            self.previous[after] = before
+
+
 @debug.time
 def post_process(points, shape, original_shape, fill):
     debug.log(f"smoothness: {fill.smoothness}")
     # debug.log_line_string(LineString(points), "pre-smoothed", "#FF0000")
-    smoothed_points = smooth_path(points, fill.smoothness)
-    smoothed_points = [InkStitchPoint.from_tuple(point) for point in smoothed_points]
+    smoothed_points = smooth_path(points, fill.smoothness, use_cache=True)
+    smoothed_points = coordinate_list_to_point_list(smoothed_points)
 
     if fill.zigzag_spacing > 0:
         stitches = running_stitch(smoothed_points, fill.zigzag_spacing / 2, fill.running_stitch_tolerance)
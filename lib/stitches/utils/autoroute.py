@@ -3,17 +3,16 @@
 # Copyright (c) 2010 Authors
 # Licensed under the GNU GPL version 3.0 or later.  See the file LICENSE for details.
 
-from itertools import combinations
-
 import inkex
 import networkx as nx
-from shapely.geometry import MultiPoint, Point
+from shapely.geometry import Point
 from shapely.ops import nearest_points
 
 from ...elements import SatinColumn
 from ...svg import get_correction_transform
 from ...svg.tags import INKSCAPE_LABEL
 from ...utils.threading import check_stop_flag
+from .connections import shortest_connections
 
 
 def find_path(graph, starting_node, ending_node):
@@ -34,49 +33,88 @@ def find_path(graph, starting_node, ending_node):
 
     check_stop_flag()
 
-    # Copy the graph so that we can remove the edges as we visit them.
-    # This also converts the directed graph into an undirected graph in the
-    # case that "preserve_order" is set.
-    graph = nx.Graph(graph)
-    graph.remove_edges_from(list(zip(path[:-1], path[1:])))
+    # The search runs on integer node and edge ids.  This also treats the
+    # directed graph as an undirected graph in the case that
+    # "preserve_order" is set.
+    nodes, node_ids, adjacency, num_edges = _undirected_adjacency(graph)
+
+    # We remove edges as we visit them by marking them here.
+    visited_edges = bytearray(num_edges)
+    for node1, node2 in zip(path[:-1], path[1:]):
+        visited_edges[adjacency[node_ids[node1]][node_ids[node2]]] = True
+
+    # the index of the DFS that last visited each node
+    visited_nodes = [-1] * len(nodes)
 
     final_path = []
     prev = None
-    for node in path:
+    for dfs_index, node in enumerate(path):
         check_stop_flag()
 
         if prev is not None:
             final_path.append((prev, node))
         prev = node
 
-        for n1, n2, edge_type in list(nx.dfs_labeled_edges(graph, node)):
-            if n1 == n2:
-                # dfs_labeled_edges gives us (start, start, "forward") for
-                # the starting node for some reason
-                continue
-
-            if edge_type == "forward":
-                final_path.append((n1, n2))
-                graph.remove_edge(n1, n2)
-            elif edge_type == "reverse":
-                final_path.append((n2, n1))
-            elif edge_type == "nontree":
-                # a "nontree" happens when there exists an edge from n1 to n2
-                # but n2 has already been visited.  It's a dead-end that runs
-                # into part of the graph that we've already traversed.  We
-                # do still need to make sure that edge is sewn, so we travel
-                # down and back on this edge.
-                #
-                # It's possible for a given "nontree" edge to be listed more
-                # than once so we'll deduplicate.
-                if (n1, n2) in graph.edges:
-                    final_path.append((n1, n2))
-                    final_path.append((n2, n1))
-                    graph.remove_edge(n1, n2)
+        start = node_ids[node]
+        visited_nodes[start] = dfs_index
+        stack = [(start, iter(adjacency[start].items()))]
+        while stack:
+            parent, children = stack[-1]
+            for child, edge in children:
+                if visited_edges[edge] or child == parent:
+                    continue
+
+                visited_edges[edge] = True
+                if visited_nodes[child] == dfs_index:
+                    # This edge runs into part of the graph that we've
+                    # already traversed.  It's a dead-end, but we do still
+                    # need to make sure that edge is sewn, so we travel
+                    # down and back on this edge.
+                    final_path.append((nodes[parent], nodes[child]))
+                    final_path.append((nodes[child], nodes[parent]))
+                else:
+                    final_path.append((nodes[parent], nodes[child]))
+                    visited_nodes[child] = dfs_index
+                    stack.append((child, iter(adjacency[child].items())))
+                    break
+            else:
+                # dead end: travel back along the edge we came from
+                stack.pop()
+                if stack:
+                    final_path.append((nodes[parent], nodes[stack[-1][0]]))
 
     return final_path
 
 
+def _undirected_adjacency(graph):
+    """Number the nodes and edges of the graph as if it were undirected.
+
+    Neighbors are listed in the same order that nx.Graph(graph) would list
+    them, so that the depth-first search in find_path() takes the same turns.
+
+    Returns:
+        (nodes, node_ids, adjacency, num_edges) where nodes is a list of the
+        graph's nodes, node_ids maps nodes to their index in that list, and
+        adjacency[i] is a dict of {neighbor id: edge id} for node i
+    """
+
+    nodes = list(graph)
+    node_ids = {node: i for i, node in enumerate(nodes)}
+    adjacency = [{} for node in nodes]
+    num_edges = 0
+
+    for node1, neighbors in graph.adj.items():
+        id1 = node_ids[node1]
+        for node2 in neighbors:
+            id2 = node_ids[node2]
+            if id2 not in adjacency[id1]:
+                adjacency[id1][id2] = num_edges
+                adjacency[id2][id1] = num_edges
+                num_edges += 1
+
+    return nodes, node_ids, adjacency, num_edges
+
+
 def add_jumps(graph, elements, preserve_order):
     """Add jump stitches between elements as necessary.
 
@@ -140,29 +178,24 @@ def _insert_jump(graph, node1, node2):
 
 
 def _add_unordered_jumps(graph, elements):
-    # networkx makes this super-easy!  k_edge_agumentation tells us what edges
-    # we need to add to ensure that the graph is fully connected.  We give it a
-    # set of possible edges that it can consider adding (avail).  Each edge has
-    # a weight, which we'll set as the length of the jump stitch.  The
-    # algorithm will minimize the total length of jump stitches added.
-    for jump in nx.k_edge_augmentation(graph, 1, avail=list(possible_jumps(graph))):
+    # Add the jumps that connect all parts of the graph with the minimal total
+    # jump stitch length.
+    for node1, node2, length in possible_jumps(graph):
         check_stop_flag()
-        graph.add_edge(*jump, jump=True)
+        graph.add_edge(node1, node2, jump=True)
 
 
 def possible_jumps(graph):
-    """All possible jump stitches in the graph with their lengths.
-
-    Returns: a generator of tuples: (node1, node2, length)
-    """
+    """The jump stitches that connect all parts of the graph with their lengths.
 
-    for component1, component2 in combinations(nx.connected_components(graph), 2):
-        points1 = MultiPoint([graph.nodes[node]['point'] for node in component1])
-        points2 = MultiPoint([graph.nodes[node]['point'] for node in component2])
+    Together, the jumps form a minimum spanning tree over the connected
+    components of the graph, so adding all of them connects the graph with
+    the shortest possible total jump length.
 
-        start_point, end_point = nearest_points(points1, points2)
+    Returns: a list of tuples: (node1, node2, length)
+    """
 
-        yield (str(start_point), str(end_point), start_point.distance(end_point))
+    return shortest_connections(nx.connected_components(graph), lambda node: graph.nodes[node]['point'].coords[0])
 
 
 def get_starting_and_ending_nodes(graph, elements, preserve_order, starting_point, ending_point):
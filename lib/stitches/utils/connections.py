@@ -0,0 +1,135 @@
+# Authors: see git history
+#
+# Copyright (c) 2024 Authors
+# Licensed under the GNU GPL version 3.0 or later.  See the file LICENSE for details.
+
+from itertools import combinations
+
+import networkx as nx
+import numpy as np
+
+from ...utils.threading import check_stop_flag
+
+
+def shortest_connections(components, get_coordinates):
+    """Find the shortest set of connections that joins all components.
+
+    The connections form a minimum spanning tree over the components, where
+    the distance between two components is the distance between their two
+    closest nodes.  This is what nx.k_edge_augmentation(graph, 1) chooses when
+    given the closest connection between every pair of components, but we
+    avoid computing the closest connection for every pair of components.
+
+    Arguments:
+        components -- an iterable of collections of nodes, one per component
+        get_coordinates -- a function that returns the (x, y) coordinates of
+                           a node
+
+    Returns:
+        a list of tuples: (node1, node2, distance)
+    """
+
+    nodes = []
+    component_ids = []
+    for component_id, component in enumerate(components):
+        nodes.extend(component)
+        component_ids.extend([component_id] * len(component))
+
+    num_components = len(set(component_ids))
+    if num_components < 2:
+        return []
+
+    check_stop_flag()
+
+    points = np.array([get_coordinates(node) for node in nodes], dtype=float)
+    component_ids = np.array(component_ids)
+
+    component_graph = nx.Graph()
+    component_graph.add_nodes_from(range(num_components))
+    _add_candidate_links(component_graph, points, component_ids, _candidate_pairs(points))
+
+    if not nx.is_connected(component_graph):
+        _add_links_between_pieces(component_graph, points, component_ids)
+
+    check_stop_flag()
+
+    connections = []
+    for component1, component2, link in nx.minimum_spanning_edges(component_graph, data=True):
+        point1, point2 = link['nodes']
+        connections.append((nodes[point1], nodes[point2], float(link['weight'])))
+
+    return connections
+
+
+def _candidate_pairs(points):
+    """Find pairs of points that could be the shortest connection between components.
+
+    A connection between two components that is part of a minimum spanning
+    tree can't have any other point in the circle that has the connection as
+    its diameter.  If it did, connecting through that point's component would
+    be shorter.  Connections with an empty circle like that are always edges
+    of the Delaunay triangulation, so we only need to look at a handful of
+    links per point instead of every pair of points.
+
+    Returns:
+        numpy array of shape (N, 2) with indices into points
+    """
+
+    # scipy.spatial takes a long time to import, and most extensions never
+    # need it
+    from scipy.spatial import Delaunay, QhullError
+
+    try:
+        triangulation = Delaunay(points)
+    except (QhullError, ValueError):
+        # Qhull can't triangulate fewer than three points or points that are
+        # all on a line.  For points on a line, the only candidates are
+        # neighbors along the line.
+        order = np.lexsort((points[:, 1], points[:, 0]))
+        return np.column_stack((order[:-1], order[1:]))
+
+    indptr, indices = triangulation.vertex_neighbor_vertices
+    starts = np.repeat(np.arange(len(points)), np.diff(indptr))
+    pairs = np.column_stack((starts, indices))
+
+    # each edge is listed in both directions
+    return pairs[pairs[:, 0] < pairs[:, 1]]
+
+
+def _add_candidate_links(component_graph, points, component_ids, pairs):
+    """Add the shortest of the candidate links between each pair of components."""
+
+    # only links between different components are interesting
+    pairs = pairs[component_ids[pairs[:, 0]] != component_ids[pairs[:, 1]]]
+    distances = np.linalg.norm(points[pairs[:, 0]] - points[pairs[:, 1]], axis=1)
+
+    # Add the longest links first so that the shortest link between two
+    # components ends up overwriting the others.
+    for i in np.argsort(distances, kind='stable')[::-1]:
+        point1, point2 = pairs[i]
+        component_graph.add_edge(int(component_ids[point1]), int(component_ids[point2]), weight=distances[i], nodes=(point1, point2))
+
+
+def _add_links_between_pieces(component_graph, points, component_ids):
+    """Connect pieces of the component graph that the candidates missed.
+
+    This only happens for degenerate input, such as points that Qhull merged
+    because they're nearly identical.  There are very few pieces left at that
+    point, so we can afford to look at every pair of them.
+    """
+
+    from scipy.spatial import KDTree
+
+    pieces = []
+    for piece in nx.connected_components(component_graph):
+        point_indices = np.flatnonzero(np.isin(component_ids, list(piece)))
+        pieces.append((point_indices, KDTree(points[point_indices])))
+
+    for (indices1, tree1), (indices2, tree2) in combinations(pieces, 2):
+        check_stop_flag()
+
+        distances, nearest = tree2.query(points[indices1])
+        closest = np.argmin(distances)
+        point1 = indices1[closest]
+        point2 = indices2[nearest[closest]]
+        component_graph.add_edge(int(component_ids[point1]), int(component_ids[point2]), weight=distances[closest], nodes=(point1, point2))
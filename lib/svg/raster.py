@@ -0,0 +1,190 @@
+# Authors: see git history
+#
+# Copyright (c) 2024 Authors
+# Licensed under the GNU GPL version 3.0 or later.  See the file LICENSE for details.
+
+from math import ceil, floor
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from .rendering import color_block_to_point_lists, stitch_height
+
+# SVG user units are 96 per inch
+SVG_DPI = 96
+
+# Lines are drawn this many times larger than requested and then scaled down,
+# which makes them anti-aliased.
+SUPERSAMPLING = 4
+
+# The supersampled masks are drawn in tiles of at most this many pixels
+# (before supersampling) on a side and the joints in batches of this many
+# dots, which keeps memory use down for large images.
+MASK_TILE_SIZE = 512
+DOT_BATCH_SIZE = 4096
+
+
+def render_stitch_plan_image(stitch_plan, dpi=SVG_DPI, realistic=False, region=None, background="white"):
+    """Draw a stitch plan into an image.
+
+    Each color block's stitches are drawn in one go straight into the image,
+    so this is much faster than rendering the stitch plan as SVG first.
+
+    Arguments:
+        stitch_plan -- the StitchPlan to draw
+        dpi -- resolution of the image
+        realistic -- shade the stitches so that they look a bit like thread
+        region -- (minx, miny, maxx, maxy) in SVG user units: the part of the
+                  stitch plan to draw.  Defaults to the whole stitch plan.
+        background -- background color, or None for a transparent image
+
+    Returns:
+        an RGBA PIL.Image
+    """
+
+    return _render(_get_lines(stitch_plan), dpi / SVG_DPI, realistic, region or get_region(stitch_plan), background)
+
+
+def render_stitch_plan_tiles(stitch_plan, tile_size=256, dpi=SVG_DPI, realistic=False, background="white"):
+    """Draw a stitch plan as a grid of square tiles.
+
+    Arguments:
+        tile_size -- width and height of each tile in pixels
+        See render_stitch_plan_image() for the other arguments.
+
+    Yields:
+        (column, row, tile image)
+    """
+
+    lines = _get_lines(stitch_plan)
+    scale = dpi / SVG_DPI
+    minx, miny, maxx, maxy = get_region(stitch_plan)
+    tile_span = tile_size / scale
+
+    columns = max(1, ceil((maxx - minx) / tile_span))
+    rows = max(1, ceil((maxy - miny) / tile_span))
+
+    for row in range(rows):
+        for column in range(columns):
+            left = minx + column * tile_span
+            top = miny + row * tile_span
+            region = (left, top, left + tile_span, top + tile_span)
+            yield column, row, _render(lines, scale, realistic, region, background)
+
+
+def get_region(stitch_plan):
+    """The stitch plan's bounding box, with room for the thread's width."""
+
+    if not stitch_plan.color_blocks:
+        return (0, 0, 0, 0)
+
+    minx, miny, maxx, maxy = stitch_plan.bounding_box
+    return (minx - stitch_height, miny - stitch_height, maxx + stitch_height, maxy + stitch_height)
+
+
+def _get_lines(stitch_plan):
+    lines = []
+    for color_block in stitch_plan:
+        point_lists = [np.array(point_list, dtype=float) for point_list in color_block_to_point_lists(color_block)]
+        if point_lists:
+            lines.append((color_block.color.visible_on_white, point_lists))
+
+    return lines
+
+
+def _render(lines, scale, realistic, region, background):
+    minx, miny, maxx, maxy = region
+    width = max(1, ceil((maxx - minx) * scale - 1e-9))
+    height = max(1, ceil((maxy - miny) * scale - 1e-9))
+
+    if background is None:
+        background = (0, 0, 0, 0)
+    image = Image.new("RGBA", (width, height), background)
+
+    thread_width = max(1.0, stitch_height * scale)
+    offset = np.array((minx, miny))
+
+    for color, point_lists in lines:
+        point_lists = [(points - offset) * scale for points in point_lists]
+
+        if realistic:
+            # a darker edge and a highlight along the middle of the thread
+            _draw_lines(image, point_lists, thread_width, color.darker)
+            _draw_lines(image, point_lists, thread_width * 0.4, color)
+        else:
+            _draw_lines(image, point_lists, thread_width, color)
+
+    return image
+
+
+def _draw_lines(image, point_lists, line_width, color):
+    """Draw anti-aliased polylines in one color.
+
+    The lines are drawn into masks that only cover their bounding box, tile
+    by tile, which are then used to paint the color into the image.
+    """
+
+    margin = line_width / 2.0 + 1
+    bounds = np.array([np.concatenate((point_list.min(axis=0), point_list.max(axis=0))) for point_list in point_lists])
+    left = max(0, floor(bounds[:, 0].min() - margin))
+    top = max(0, floor(bounds[:, 1].min() - margin))
+    right = min(image.width, ceil(bounds[:, 2].max() + margin))
+    bottom = min(image.height, ceil(bounds[:, 3].max() + margin))
+
+    for tile_top in range(top, bottom, MASK_TILE_SIZE):
+        tile_bottom = min(bottom, tile_top + MASK_TILE_SIZE)
+        for tile_left in range(left, right, MASK_TILE_SIZE):
+            tile_right = min(right, tile_left + MASK_TILE_SIZE)
+
+            in_tile = ((bounds[:, 0] - margin < tile_right) & (bounds[:, 2] + margin > tile_left) &
+                       (bounds[:, 1] - margin < tile_bottom) & (bounds[:, 3] + margin > tile_top))
+            tile_point_lists = [point_lists[i] for i in np.flatnonzero(in_tile)]
+            if tile_point_lists:
+                _draw_lines_tile(image, tile_point_lists, line_width, color, (tile_left, tile_top, tile_right, tile_bottom))
+
+
+def _draw_lines_tile(image, point_lists, line_width, color, tile):
+    left, top, right, bottom = tile
+
+    mask = Image.new("L", ((right - left) * SUPERSAMPLING, (bottom - top) * SUPERSAMPLING), 0)
+    draw = ImageDraw.Draw(mask)
+    supersampled_width = max(1, round(line_width * SUPERSAMPLING))
+    vertices = []
+    for point_list in point_lists:
+        coordinates = (point_list - (left, top)) * SUPERSAMPLING
+        draw.line(coordinates.ravel().tolist(), fill=255, width=supersampled_width)
+        vertices.append(coordinates[1:-1])
+
+    # Pillow can round the joints between lines, but it does that in Python
+    # one joint at a time.  It's much faster to stamp a dot onto every joint
+    # ourselves.
+    mask = np.array(mask)
+    _draw_dots(mask, np.concatenate(vertices), supersampled_width / 2.0)
+    mask = Image.fromarray(mask).reduce(SUPERSAMPLING)
+
+    image.paste(tuple(round(channel) for channel in color.rgb) + (255,), (left, top, right, bottom), mask)
+
+
+def _draw_dots(mask, centers, radius):
+    if len(centers) == 0 or radius < 1:
+        return
+
+    offset_range = np.arange(-ceil(radius), ceil(radius) + 1)
+    offset_x, offset_y = np.meshgrid(offset_range, offset_range)
+    in_disk = np.hypot(offset_x, offset_y) <= radius
+    offset_x = offset_x[in_disk]
+    offset_y = offset_y[in_disk]
+
+    # only the dots that reach into the mask
+    centers = np.rint(centers).astype(int)
+    reach = ceil(radius)
+    near = ((centers[:, 0] >= -reach) & (centers[:, 0] < mask.shape[1] + reach) &
+            (centers[:, 1] >= -reach) & (centers[:, 1] < mask.shape[0] + reach))
+    centers = centers[near]
+
+    for start in range(0, len(centers), DOT_BATCH_SIZE):
+        batch = centers[start:start + DOT_BATCH_SIZE]
+        x = (batch[:, 0, np.newaxis] + offset_x).ravel()
+        y = (batch[:, 1, np.newaxis] + offset_y).ravel()
+        inside = (x >= 0) & (x < mask.shape[1]) & (y >= 0) & (y < mask.shape[0])
+        mask[y[inside], x[inside]] = 255
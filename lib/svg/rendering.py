@@ -3,14 +3,13 @@
 # Copyright (c) 2010 Authors
 # Licensed under the GNU GPL version 3.0 or later.  See the file LICENSE for details.
 
-import math
-from math import pi
-
 import inkex
+import numpy as np
 
 from ..i18n import _
-from ..utils import Point, cache
-from .tags import INKSCAPE_GROUPMODE, INKSCAPE_LABEL, INKSTITCH_ATTRIBS
+from ..utils import cache
+from .tags import (INKSCAPE_GROUPMODE, INKSCAPE_LABEL, INKSTITCH_ATTRIBS,
+                   XLINK_HREF)
 from .units import PIXELS_PER_MM, get_viewbox_transform
 
 # The stitch vector path looks like this:
@@ -37,6 +36,11 @@ stitch_height = 1.216
 # of space on the short sides and significantly slow down rendering.
 stitch_path = "M0,0c0.4,0,0.4,0.3,0.4,0.6c0,0.3,-0.1,0.6,-0.4,0.6v0.2,-0.2h-%sc-0.4,0,-0.4,-0.3,-0.4,-0.6c0,-0.3,0.1,-0.6,0.4,-0.6v-0.2,0.2z"
 
+# Realistic stitches are rounded to a multiple of this length (in pixels).
+# Stitches of about the same length then share the same path in <defs>, and
+# each stitch is just a <use> that moves the path into place.
+realistic_stitch_length_step = 0.1
+
 # This filter makes the above stitch path look like a real stitch with lighting.
 realistic_filter = """
     <filter
@@ -111,32 +115,55 @@ realistic_filter = """
 """
 
 
-def realistic_stitch(start, end):
-    """Generate a stitch vector path given a start and end point."""
+def realistic_stitch_transforms(point_list):
+    """Find where to place the realistic stitches between consecutive points.
+
+    The stitch path is rotated around its center and moved to the center of
+    the stitch, for a whole list of points at once.
 
-    end = Point(*end)
-    start = Point(*start)
+    Returns:
+        a list of tuples: (length step, transform), where the length of the
+        stitch is length step * realistic_stitch_length_step
+    """
 
-    stitch_length = (end - start).length()
-    stitch_center = Point((end.x+start.x)/2.0, (end[1]+start[1])/2.0)
-    stitch_direction = (end - start)
-    stitch_angle = math.atan2(stitch_direction.y, stitch_direction.x) * (180 / pi)
+    points = np.array(point_list, dtype=float)
+    start = points[:-1]
+    end = points[1:]
+    direction = end - start
 
-    stitch_length = max(0, stitch_length - 0.2 * PIXELS_PER_MM)
+    stitch_length = np.maximum(0, np.hypot(direction[:, 0], direction[:, 1]) - 0.2 * PIXELS_PER_MM)
+    length_steps = np.rint(stitch_length / realistic_stitch_length_step).astype(int)
+    stitch_length = length_steps * realistic_stitch_length_step
 
-    # create the path by filling in the length in the template
-    path = inkex.Path(stitch_path % stitch_length).to_arrays()
+    angle = np.arctan2(direction[:, 1], direction[:, 0])
+    cos = np.cos(angle)
+    sin = np.sin(angle)
+    center = (start + end) / 2.0
 
-    # rotate the path to match the stitch
-    rotation_center_x = -stitch_length / 2.0
-    rotation_center_y = stitch_height / 2.0
+    translate_x = center[:, 0] + cos * stitch_length / 2.0 + sin * stitch_height / 2.0
+    translate_y = center[:, 1] + sin * stitch_length / 2.0 - cos * stitch_height / 2.0
 
-    path = inkex.Path(path).rotate(stitch_angle, (rotation_center_x, rotation_center_y))
+    transforms = ["translate(%.2f %.2f) rotate(%.1f)" % values
+                  for values in zip(translate_x.tolist(), translate_y.tolist(), np.degrees(angle).tolist())]
 
-    # move the path to the location of the stitch
-    path = inkex.Path(path).translate(stitch_center.x - rotation_center_x, stitch_center.y - rotation_center_y)
+    return list(zip(length_steps.tolist(), transforms))
 
-    return str(path)
+
+def realistic_stitch_id(length_step):
+    return "realistic-stitch-%d" % length_step
+
+
+def ensure_realistic_stitch_paths(svg, length_steps):
+    """Make sure <defs> has a stitch path for each of the stitch lengths."""
+
+    existing_ids = {node.get('id') for node in svg.defs}
+    for length_step in sorted(length_steps):
+        stitch_id = realistic_stitch_id(length_step)
+        if stitch_id not in existing_ids:
+            svg.defs.append(inkex.PathElement(attrib={
+                'id': stitch_id,
+                'd': stitch_path % (length_step * realistic_stitch_length_step)
+            }))
 
 
 def color_block_to_point_lists(color_block):
@@ -168,16 +195,34 @@ def get_correction_transform(svg):
 
 
 def color_block_to_realistic_stitches(color_block, svg, destination):
+    """Draw each stitch as a <use> of a shared stitch path.
+
+    Every stitch gets the filter on its own, so that neighbouring stitches
+    aren't lit as one.  The filter is set on a group around the <use> rather
+    than on the <use> itself: the group has no transform, so the filter's
+    light and region are in the same coordinates as if the stitch path were
+    drawn in place.
+    """
+
+    color = color_block.color.visible_on_white.darker.to_hex_str()
+    group = inkex.Group(attrib={
+        'style': "fill: %s; stroke: none;" % color,
+        'transform': get_correction_transform(svg)
+    })
+
+    length_steps = set()
     for point_list in color_block_to_point_lists(color_block):
-        color = color_block.color.visible_on_white.darker.to_hex_str()
-        start = point_list[0]
-        for point in point_list[1:]:
-            destination.append(inkex.PathElement(attrib={
-                'style': "fill: %s; stroke: none; filter: url(#realistic-stitch-filter);" % color,
-                'd': realistic_stitch(start, point),
-                'transform': get_correction_transform(svg)
+        for length_step, transform in realistic_stitch_transforms(point_list):
+            length_steps.add(length_step)
+            stitch_group = inkex.Group(attrib={'style': "filter: url(#realistic-stitch-filter);"})
+            stitch_group.append(inkex.Use(attrib={
+                XLINK_HREF: "#%s" % realistic_stitch_id(length_step),
+                'transform': transform
             }))
-            start = point
+            group.append(stitch_group)
+
+    ensure_realistic_stitch_paths(svg, length_steps)
+    destination.append(group)
 
 
 def color_block_to_paths(color_block, svg, destination, visual_commands):
@@ -221,7 +266,7 @@ def color_block_to_paths(color_block, svg, destination, visual_commands):
             path.set(INKSTITCH_ATTRIBS['stop_after'], 'true')
 
 
-def render_stitch_plan(svg, stitch_plan, realistic=False, visual_commands=True):
+def get_stitch_plan_layer(svg):
     layer = svg.findone(".//*[@id='__inkstitch_stitch_plan__']")
     if layer is None:
         layer = inkex.Group(attrib={
@@ -238,17 +283,31 @@ def render_stitch_plan(svg, stitch_plan, realistic=False, visual_commands=True):
 
     svg.append(layer)
 
+    return layer
+
+
+def render_color_block(svg, layer, color_block, index, realistic=False, visual_commands=True):
+    group = inkex.Group(attrib={
+        'id': '__color_block_%d__' % index,
+        INKSCAPE_LABEL: "color block %d" % (index + 1)
+    })
+    layer.append(group)
+    if realistic:
+        color_block_to_realistic_stitches(color_block, svg, group)
+    else:
+        color_block_to_paths(color_block, svg, group, visual_commands)
+
+
+def add_realistic_filter(svg):
+    filter_document = inkex.load_svg(realistic_filter)
+    svg.defs.append(filter_document.getroot())
+
+
+def render_stitch_plan(svg, stitch_plan, realistic=False, visual_commands=True):
+    layer = get_stitch_plan_layer(svg)
+
     for i, color_block in enumerate(stitch_plan):
-        group = inkex.Group(attrib={
-            'id': '__color_block_%d__' % i,
-            INKSCAPE_LABEL: "color block %d" % (i + 1)
-        })
-        layer.append(group)
-        if realistic:
-            color_block_to_realistic_stitches(color_block, svg, group)
-        else:
-            color_block_to_paths(color_block, svg, group, visual_commands)
+        render_color_block(svg, layer, color_block, i, realistic, visual_commands)
 
     if realistic:
-        filter_document = inkex.load_svg(realistic_filter)
-        svg.defs.append(filter_document.getroot())
+        add_realistic_filter(svg)
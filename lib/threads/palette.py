@@ -3,41 +3,83 @@
 # Copyright (c) 2010 Authors
 # Licensed under the GNU GPL version 3.0 or later.  See the file LICENSE for details.
 
+import os
 from collections.abc import Set
 
-from colormath.color_conversions import convert_color
-from colormath.color_diff import delta_e_cie1994
-from colormath.color_objects import LabColor, sRGBColor
+import numpy as np
 
+from ..utils.cache import get_thread_catalog_cache
 from .color import ThreadColor
 
+# Change this when the format of the cached palette data changes.
+PALETTE_CACHE_VERSION = 1
 
-def compare_thread_colors(color1, color2):
-    # K_L=2 indicates textiles
-    return delta_e_cie1994(color1, color2, K_L=2)
+# CIE94 parameters used by compare_thread_colors_array()
+# K_L=2 indicates textiles
+K_L = 2
+K_1 = 0.045
+K_2 = 0.015
 
 
-class ThreadPalette(Set):
-    """Holds a set of ThreadColors all from the same manufacturer."""
+def rgb_to_lab(rgb):
+    # colormath takes a long time to import (it pulls in networkx), and
+    # palettes usually come from the thread catalog cache, so we only import
+    # it when we really need it.
+    from colormath.color_conversions import convert_color
+    from colormath.color_objects import LabColor, sRGBColor
 
-    def __init__(self, palette_file):
-        self.threads = dict()
-        self.parse_palette_file(palette_file)
+    return convert_color(sRGBColor(*rgb, is_upscaled=True), LabColor).get_value_tuple()
 
-    def parse_palette_file(self, palette_file):
-        """Read a GIMP palette file and load thread colors.
 
-        Example file:
+def compare_thread_colors_array(reference_labs, lab):
+    """CIE94 color difference between many threads and one color.
 
-        GIMP Palette
-        Name: Ink/Stitch: Metro
-        Columns: 4
-        # RGB Value                                 Color Name Number
-        240     186     212                         Sugar Pink   1624
-        237     171     194                           Carnatio   1636
+    This gives the same results as colormath's delta_e_cie1994(), for all of
+    the threads at once.
 
-        """
+    Arguments:
+        reference_labs -- numpy array of shape (N, 3): the Lab values of the
+                          threads to compare against (color1)
+        lab -- the Lab value of the color to compare (color2)
+
+    Returns:
+        numpy array of N delta E values
+    """
+
+    reference_chroma = np.hypot(reference_labs[:, 1], reference_labs[:, 2])
+    chroma = np.hypot(lab[1], lab[2])
 
+    delta_lab = reference_labs - lab
+    delta_l = delta_lab[:, 0]
+    delta_c = reference_chroma - chroma
+    delta_h_squared = delta_lab[:, 1] ** 2 + delta_lab[:, 2] ** 2 - delta_c ** 2
+    delta_h = np.sqrt(delta_h_squared.clip(min=0))
+
+    s_c = 1 + K_1 * reference_chroma
+    s_h = 1 + K_2 * reference_chroma
+
+    return np.sqrt((delta_l / K_L) ** 2 + (delta_c / s_c) ** 2 + (delta_h / s_h) ** 2)
+
+
+class ThreadPalette(Set):
+    """Holds a set of ThreadColors all from the same manufacturer.
+
+    Only the palette's name is read right away.  The threads are loaded the
+    first time they're needed, from the thread catalog cache if the palette
+    file hasn't changed since it was last parsed.
+    """
+
+    def __init__(self, palette_file):
+        self.palette_file = palette_file
+        self.parse_palette_header(palette_file)
+
+        self._threads = None
+
+        # built on demand by nearest_color()
+        self._lab_index = None
+        self._nearest_colors = {}
+
+    def parse_palette_header(self, palette_file):
         with open(palette_file, encoding='utf8') as palette:
             line = palette.readline().strip()
 
@@ -50,11 +92,56 @@ class ThreadPalette(Set):
             if self.name.lower().startswith('name: ink/stitch: '):
                 self.name = self.name[18:]
 
-            # number of columns
-            palette.readline()
+    @property
+    def threads(self):
+        """The ThreadColors in this palette, mapped to their Lab values."""
+
+        if self._threads is None:
+            self._threads = dict()
+            if self.is_gimp_palette:
+                names, numbers, rgbs, labs = self._get_palette_data()
+                for name, number, rgb, lab in zip(names, numbers, rgbs.tolist(), labs.tolist()):
+                    self._threads[ThreadColor(rgb, name, number, manufacturer=self.name)] = tuple(lab)
 
-            # headers
-            palette.readline()
+        return self._threads
+
+    def _get_palette_data(self):
+        stat = os.stat(self.palette_file)
+        key = ("palette", PALETTE_CACHE_VERSION, os.path.realpath(self.palette_file), stat.st_mtime_ns, stat.st_size)
+
+        thread_catalog_cache = get_thread_catalog_cache()
+        palette_data = thread_catalog_cache.get(key)
+        if palette_data is None:
+            palette_data = self.parse_palette_file(self.palette_file)
+            thread_catalog_cache.set(key, palette_data)
+
+        return palette_data
+
+    def parse_palette_file(self, palette_file):
+        """Read the thread colors from a GIMP palette file.
+
+        Example file:
+
+        GIMP Palette
+        Name: Ink/Stitch: Metro
+        Columns: 4
+        # RGB Value                                 Color Name Number
+        240     186     212                         Sugar Pink   1624
+        237     171     194                           Carnatio   1636
+
+        Returns:
+            (names, numbers, RGB array, Lab array)
+        """
+
+        names = []
+        numbers = []
+        rgbs = []
+        labs = []
+
+        with open(palette_file, encoding='utf8') as palette:
+            # header, name, number of columns and column headers
+            for i in range(4):
+                palette.readline()
 
             for line in palette:
                 try:
@@ -62,12 +149,17 @@ class ThreadPalette(Set):
                     thread_color = [int(field) for field in fields[:3]]
                     thread_name, thread_number = fields[3].strip().rsplit(" ", 1)
                     thread_name = thread_name.strip()
-
-                    thread = ThreadColor(thread_color, thread_name, thread_number, manufacturer=self.name)
-                    self.threads[thread] = convert_color(sRGBColor(*thread_color, is_upscaled=True), LabColor)
+                    lab = rgb_to_lab(thread_color)
                 except (ValueError, IndexError):
                     continue
 
+                names.append(thread_name)
+                numbers.append(thread_number)
+                rgbs.append(thread_color)
+                labs.append(lab)
+
+        return names, numbers, np.array(rgbs, dtype=np.int64).reshape((-1, 3)), np.array(labs, dtype=float).reshape((-1, 3))
+
     def __contains__(self, thread):
         return thread in self.threads
 
@@ -82,7 +174,43 @@ class ThreadPalette(Set):
 
         if isinstance(color, ThreadColor):
             color = color.rgb
-
-        color = convert_color(sRGBColor(*color, is_upscaled=True), LabColor)
-
-        return min(self, key=lambda thread: compare_thread_colors(self.threads[thread], color))
+        color = tuple(color)
+
+        if color not in self._nearest_colors:
+            self._nearest_colors[color] = self._find_nearest_color(color)
+
+        return self._nearest_colors[color]
+
+    def _find_nearest_color(self, color):
+        if not self.threads:
+            raise ValueError("palette %s has no threads" % self.name)
+
+        threads, labs, tree, max_scale = self._get_lab_index()
+        lab = np.array(rgb_to_lab(color))
+
+        # CIE94 divides the differences in lightness, chroma and hue by at
+        # least 1 and at most max_scale.  The Euclidean distance in Lab space
+        # is an upper bound for delta E, so the closest thread by Euclidean
+        # distance limits how far away the best match can be.
+        closest = tree.query(lab)[1]
+        max_delta_e = compare_thread_colors_array(labs[[closest]], lab)[0]
+        candidates = np.array(sorted(tree.query_ball_point(lab, max_delta_e * max_scale + 1e-9)), dtype=int)
+        if len(candidates) == 0:
+            candidates = np.array([closest])
+
+        # ties go to the thread listed first, like min() would
+        delta_e = compare_thread_colors_array(labs[candidates], lab)
+        return threads[candidates[np.argmin(delta_e)]]
+
+    def _get_lab_index(self):
+        if self._lab_index is None:
+            threads = list(self.threads)
+            labs = np.array([self.threads[thread] for thread in threads], dtype=float)
+            max_chroma = np.hypot(labs[:, 1], labs[:, 2]).max()
+            max_scale = max(K_L, 1 + K_1 * max_chroma, 1 + K_2 * max_chroma)
+            # scipy.spatial takes a long time to import, so we only import it
+            # when we need to match colors
+            from scipy.spatial import KDTree
+            self._lab_index = (threads, labs, KDTree(labs), max_scale)
+
+        return self._lab_index
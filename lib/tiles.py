@@ -5,8 +5,9 @@ import inkex
 import json
 import lxml
 import networkx as nx
-from shapely.geometry import LineString, MultiLineString
-from shapely.prepared import prep
+import numpy as np
+import shapely
+from shapely.geometry import MultiLineString
 
 from .debug import debug
 from .i18n import _
@@ -53,6 +54,11 @@ class Tile:
         return os.path.splitext(os.path.basename(tile_path))[0]
 
     def _load(self):
+        if self.tile is not None:
+            # Tiles are cached by all_tiles(), so we only need to parse the
+            # tile SVG once.
+            return
+
         self._load_paths(self.tile_svg)
         self._load_dimensions(self.tile_svg)
         self._load_parallelogram(self.tile_svg)
@@ -101,16 +107,6 @@ class Tile:
 
         return center, width, height
 
-    def _translate_tile(self, tile, shift):
-        translated_tile = []
-
-        for start, end in tile:
-            start += shift
-            end += shift
-            translated_tile.append((start.as_int().as_tuple(), end.as_int().as_tuple()))
-
-        return translated_tile
-
     def _scale_and_rotate(self, x_scale, y_scale, angle):
         transformed_shift0 = self.shift0.scale(x_scale, y_scale).rotate(angle)
         transformed_shift1 = self.shift1.scale(x_scale, y_scale).rotate(angle)
@@ -137,9 +133,9 @@ class Tile:
         shift0, shift1, tile = self._scale_and_rotate(x_scale, y_scale, angle)
 
         shape_center, shape_width, shape_height = self._get_center_and_dimensions(shape)
-        prepared_shape = prep(shape)
+        shapely.prepare(shape)
 
-        return self._generate_graph(prepared_shape, shape_center, shape_width, shape_height, shift0, shift1, tile)
+        return self._generate_graph(shape, shape_center, shape_width, shape_height, shift0, shift1, tile)
 
     @debug.time
     def _generate_graph(self, shape, shape_center, shape_width, shape_height, shift0, shift1, tile):
@@ -153,22 +149,27 @@ class Tile:
         x_cutoff = shape_width / 2 + tile_diagonal
         y_cutoff = shape_height / 2 + tile_diagonal
 
-        for repeat0 in range(-num_tiles, num_tiles):
-            for repeat1 in range(-num_tiles, num_tiles):
-                check_stop_flag()
+        check_stop_flag()
+
+        # Compute the offsets of all tile repeats at once and throw away the
+        # ones that can't be inside the shape.
+        repeats = np.arange(-num_tiles, num_tiles)
+        repeat0, repeat1 = np.meshgrid(repeats, repeats, indexing='ij')
+        repeat0 = repeat0.reshape((-1, 1))
+        repeat1 = repeat1.reshape((-1, 1))
+        offsets = repeat0 * np.array(shift0.as_tuple()) + repeat1 * np.array(shift1.as_tuple())
+        offsets = offsets[(np.abs(offsets[:, 0]) <= x_cutoff) & (np.abs(offsets[:, 1]) <= y_cutoff)]
 
-                offset0 = repeat0 * shift0
-                offset1 = repeat1 * shift1
-                offset = offset0 + offset1
+        # Shape: (number of repeats, number of lines in the tile, start/end, x/y)
+        tile_lines = np.array([(start.as_tuple(), end.as_tuple()) for start, end in tile])
+        lines = tile_lines[np.newaxis, :, :, :] + (offsets + shape_center.as_tuple())[:, np.newaxis, np.newaxis, :]
+        lines = np.rint(lines.reshape((-1, 2, 2)))
 
-                if abs(offset.x) > x_cutoff or abs(offset.y) > y_cutoff:
-                    continue
+        check_stop_flag()
 
-                this_tile = self._translate_tile(tile, offset + shape_center)
-                for line in this_tile:
-                    line_string = LineString(line)
-                    if shape.contains(line_string):
-                        graph.add_edge(line[0], line[1])
+        inside = shapely.contains(shape, shapely.linestrings(lines))
+        for start, end in lines[inside].astype(int).tolist():
+            graph.add_edge(tuple(start), tuple(end))
 
         self._remove_dead_ends(graph)
 
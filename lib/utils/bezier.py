@@ -0,0 +1,152 @@
+# Authors: see git history
+#
+# Copyright (c) 2024 Authors
+# Licensed under the GNU GPL version 3.0 or later.  See the file LICENSE for details.
+
+import numpy as np
+
+# Subdividing a bezier more often than this won't make it any flatter within
+# floating point precision.
+MAX_SUBDIVISIONS = 50
+
+
+def flatten_csp(csp, tolerance=0.1):
+    """Approximate a cubic superpath with line segments.
+
+    This is a vectorized version of inkex.bezier.cspsubdiv().  It creates the
+    same points: each bezier is split in half until its control points are
+    within tolerance of the line between its end points.  The beziers of all
+    subpaths are subdivided together.
+
+    Arguments:
+        csp -- a cubic superpath: a list of subpaths, each of which is a list
+               of [control_before, point, control_after]
+        tolerance -- the maximum distance of a bezier's control points from the
+                     line segment that replaces it
+
+    Returns:
+        a list of numpy arrays of shape (N, 2), one per subpath
+    """
+
+    if not csp:
+        return []
+
+    subpath_lengths = [len(subpath) for subpath in csp]
+    nodes = np.array([node for subpath in csp for node in subpath], dtype=float).reshape((-1, 3, 2))
+
+    # Each bezier runs from one node's point to the next node's point, using
+    # the first node's control_after and the second node's control_before.
+    subpath_ends = np.cumsum(subpath_lengths)
+    is_last_node = np.zeros(len(nodes), dtype=bool)
+    is_last_node[subpath_ends - 1] = True
+    first_nodes = np.flatnonzero(~is_last_node)
+    beziers = np.stack((nodes[first_nodes, 1], nodes[first_nodes, 2], nodes[first_nodes + 1, 0], nodes[first_nodes + 1, 1]), axis=1)
+
+    # Which bezier each final line segment came from, along with the
+    # parameter t where it starts, so that we can sort them back into order.
+    bezier_ids = np.arange(len(beziers))
+    starts = np.zeros(len(beziers))
+    width = 1.0
+
+    segment_ends = [np.empty((0, 2))]
+    segment_ids = [np.empty(0, dtype=int)]
+    segment_starts = [np.empty(0)]
+
+    for i in range(MAX_SUBDIVISIONS + 1):
+        if len(beziers) == 0:
+            break
+
+        if i == MAX_SUBDIVISIONS:
+            flat = np.ones(len(beziers), dtype=bool)
+        elif i == 0:
+            # Beziers with NaN or infinite coordinates are never flat and would
+            # double at every level until we run out of memory, so they become
+            # a straight line right away.
+            flat = (_max_distance(beziers) <= tolerance) | ~np.isfinite(beziers).all(axis=(1, 2))
+        else:
+            flat = _max_distance(beziers) <= tolerance
+
+        segment_ends.append(beziers[flat, 3])
+        segment_ids.append(bezier_ids[flat])
+        segment_starts.append(starts[flat])
+
+        beziers = beziers[~flat]
+        bezier_ids = bezier_ids[~flat]
+        starts = starts[~flat]
+
+        width /= 2
+        first_halves, second_halves = _split_in_half(beziers)
+        beziers = np.concatenate((first_halves, second_halves))
+        bezier_ids = np.concatenate((bezier_ids, bezier_ids))
+        starts = np.concatenate((starts, starts + width))
+
+    segment_ends = np.concatenate(segment_ends)
+    segment_ids = np.concatenate(segment_ids)
+    segment_starts = np.concatenate(segment_starts)
+    order = np.lexsort((segment_starts, segment_ids))
+    segment_ends = segment_ends[order]
+    segment_ids = segment_ids[order]
+
+    # Every subpath starts with its first point, followed by the end point
+    # of each of its line segments.
+    subpath_ids = np.repeat(np.arange(len(csp)), subpath_lengths)[first_nodes][segment_ids]
+    split_at = np.searchsorted(subpath_ids, np.arange(1, len(csp)))
+    first_points = nodes[subpath_ends - np.array(subpath_lengths), 1]
+
+    return [np.concatenate((first_point[np.newaxis], points))
+            for first_point, points in zip(first_points, np.split(segment_ends, split_at))]
+
+
+def flatten_subpath(subpath, tolerance=0.1):
+    """Approximate one subpath of a cubic superpath with line segments.
+
+    Returns:
+        a numpy array of shape (N, 2)
+    """
+
+    return flatten_csp([subpath], tolerance)[0]
+
+
+def _max_distance(beziers):
+    """The distance of the farther control point from the line between the end points.
+
+    This is the same as inkex.bezier.maxdist(), for many beziers at once.
+    """
+
+    start = beziers[:, 0]
+    end = beziers[:, 3]
+    direction = end - start
+    length_squared = np.sum(direction * direction, axis=1)
+    length = np.hypot(direction[:, 0], direction[:, 1])
+
+    distances = []
+    for control_point in (beziers[:, 1], beziers[:, 2]):
+        to_start = start - control_point
+        along = np.sum((control_point - start) * direction, axis=1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            perpendicular = np.abs(direction[:, 0] * to_start[:, 1] - to_start[:, 0] * direction[:, 1]) / length
+
+        distance = np.where(along <= 0, np.hypot(*to_start.T),
+                            np.where(length_squared <= along, np.hypot(*(end - control_point).T), perpendicular))
+        distances.append(distance)
+
+    return np.maximum(*distances)
+
+
+def _split_in_half(beziers):
+    """Split beziers at t=0.5 using de Casteljau's algorithm.
+
+    Returns:
+        (first halves, second halves)
+    """
+
+    p0, p1, p2, p3 = beziers[:, 0], beziers[:, 1], beziers[:, 2], beziers[:, 3]
+    m1 = p0 + 0.5 * (p1 - p0)
+    m2 = p1 + 0.5 * (p2 - p1)
+    m3 = p2 + 0.5 * (p3 - p2)
+    m4 = m1 + 0.5 * (m2 - m1)
+    m5 = m2 + 0.5 * (m3 - m2)
+    m = m4 + 0.5 * (m5 - m4)
+
+    return np.stack((p0, m1, m4, m), axis=1), np.stack((m, m5, m3, p3), axis=1)
@@ -6,6 +6,7 @@ import os
 import atexit
 import hashlib
 import pickle
+from collections import OrderedDict
 
 import appdirs
 import diskcache
@@ -23,6 +24,32 @@ def cache(*args, **kwargs):
     return lru_cache(maxsize=None)(*args, **kwargs)
 
 
+# The cache size in the preferences is shared by the stitch plan cache and
+# the geometry cache.  The geometry cache gets this fraction of it.
+GEOMETRY_CACHE_SHARE = 0.25
+
+
+def get_cache_size_limits():
+    """Return the size limits in bytes of (stitch plan cache, geometry cache)."""
+
+    size_limit = int(global_settings['cache_size'] * 1024 * 1024)
+    geometry_size_limit = int(size_limit * GEOMETRY_CACHE_SHARE)
+
+    return size_limit - geometry_size_limit, geometry_size_limit
+
+
+def update_cache_size_limits():
+    """Apply a changed cache size from the preferences to both caches."""
+
+    stitch_plan_size_limit, geometry_size_limit = get_cache_size_limits()
+
+    stitch_plan_cache = get_stitch_plan_cache()
+    stitch_plan_cache.size_limit = stitch_plan_size_limit
+    stitch_plan_cache.cull()
+
+    get_geometry_cache().set_size_limit(geometry_size_limit)
+
+
 __stitch_plan_cache = None
 
 
@@ -31,7 +58,7 @@ def get_stitch_plan_cache():
 
     if __stitch_plan_cache is None:
         cache_dir = os.path.join(appdirs.user_config_dir('inkstitch'), 'cache', 'stitch_plan')
-        size_limit = global_settings['cache_size'] * 1024 * 1024
+        size_limit = get_cache_size_limits()[0]
         __stitch_plan_cache = diskcache.Cache(cache_dir, size=size_limit)
         __stitch_plan_cache.size_limit = size_limit
         atexit.register(__stitch_plan_cache.close)
@@ -39,6 +66,101 @@ def get_stitch_plan_cache():
     return __stitch_plan_cache
 
 
+class GeometryCache(object):
+    """Parsed and flattened geometry of SVG nodes.
+
+    Parsing paths, applying transforms, flattening beziers and building shapely
+    shapes is done again every time an element is created for a node.  That
+    happens more than once per run (markers, clones and guides create their own
+    elements) and on every run of an extension.
+
+    Values are kept pickled on disk next to the stitch plan cache and, up to
+    memory_size_limit bytes of the most recently used ones, in memory.  Every
+    call to get() returns a new copy, so callers are free to modify it.
+    """
+
+    def __init__(self, disk_cache, memory_size_limit=32 * 1024 * 1024):
+        self._disk_cache = disk_cache
+        self._memory_cache = OrderedDict()
+        self._memory_size = 0
+        self._memory_size_limit = memory_size_limit
+
+    def get(self, key, compute, persist=True):
+        """Return the cached value for key, or cache and return compute().
+
+        If persist is False, the value is only cached in memory.  That's
+        meant for values that are cheap to compute compared to reading them
+        from disk.
+        """
+
+        data = self._memory_cache.get(key)
+
+        if data is not None:
+            self._memory_cache.move_to_end(key)
+        else:
+            if persist:
+                data = self._disk_cache.get(key)
+
+            if data is None:
+                data = pickle.dumps(compute(), protocol=pickle.HIGHEST_PROTOCOL)
+                if persist:
+                    self._disk_cache[key] = data
+
+            self._remember(key, data)
+
+        return pickle.loads(data)
+
+    def _remember(self, key, data):
+        self._memory_cache[key] = data
+        self._memory_size += len(data)
+
+        while self._memory_size > self._memory_size_limit:
+            old_key, old_data = self._memory_cache.popitem(last=False)
+            self._memory_size -= len(old_data)
+
+    def clear(self):
+        self._memory_cache.clear()
+        self._memory_size = 0
+        self._disk_cache.clear(retry=True)
+
+    def set_size_limit(self, size_limit):
+        self._disk_cache.size_limit = size_limit
+        self._disk_cache.cull()
+
+
+__geometry_cache = None
+
+
+def get_geometry_cache():
+    global __geometry_cache
+
+    if __geometry_cache is None:
+        cache_dir = os.path.join(appdirs.user_config_dir('inkstitch'), 'cache', 'geometry')
+        size_limit = get_cache_size_limits()[1]
+        disk_cache = diskcache.Cache(cache_dir, size=size_limit)
+        disk_cache.size_limit = size_limit
+        atexit.register(disk_cache.close)
+        __geometry_cache = GeometryCache(disk_cache)
+
+    return __geometry_cache
+
+
+__thread_catalog_cache = None
+
+
+def get_thread_catalog_cache():
+    """Parsed thread palettes, so that we don't parse every palette file on every run."""
+
+    global __thread_catalog_cache
+
+    if __thread_catalog_cache is None:
+        cache_dir = os.path.join(appdirs.user_config_dir('inkstitch'), 'cache', 'thread_catalog')
+        __thread_catalog_cache = diskcache.Cache(cache_dir)
+        atexit.register(__thread_catalog_cache.close)
+
+    return __thread_catalog_cache
+
+
 class CacheKeyGenerator(object):
     """Generate cache keys given arbitrary data.
 
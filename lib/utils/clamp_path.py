@@ -1,143 +1,153 @@
-from shapely.geometry import LineString, Point as ShapelyPoint, MultiPolygon
-from shapely.prepared import prep
-from .geometry import Point, ensure_geometry_collection
+from functools import lru_cache
 
+import numpy as np
+import shapely
+from shapely.geometry import LineString, Point as ShapelyPoint
 
-def path_to_segments(path):
-    """Convert a path of Points into a list of segments as LineStrings"""
-    for start, end in zip(path[:-1], path[1:]):
-        yield LineString((start, end))
+from .geometry import Point, ensure_geometry_collection
 
 
-def segments_to_path(segments):
-    """Convert a list of contiguous LineStrings into a list of Points."""
-    coords = [segments[0].coords[0]]
+class PolygonClamper:
+    """Constrain paths to a Polygon.
 
-    for segment in segments:
-        coords.extend(segment.coords[1:])
+    Everything that only depends on the polygon is computed once, so that the
+    same shape can be used to clamp many paths (e.g. all travel paths of an
+    auto-fill).  Use get_polygon_clamper() to share instances.
+    """
 
-    return [Point(x, y) for x, y in coords]
+    def __init__(self, polygon):
+        self.boundary = polygon.boundary
+
+        # contains() checks can fail without the buffer.
+        self.buffered_polygon = polygon.buffer(1e-9)
+        shapely.prepare(self.buffered_polygon)
+
+        # Tiny holes are ignored when traveling along the border.
+        parts = shapely.get_parts(polygon)
+        rings = list(shapely.get_exterior_ring(parts))
+        for part in parts:
+            rings.extend(interior for interior in part.interiors if interior.length > 0.1)
+        self.rings = rings
+        self.ring_tree = shapely.STRtree(rings)
+
+        # arc length of each ring's vertices, used to walk along the ring
+        self.ring_vertices = []
+        self.ring_distances = []
+        for ring in rings:
+            coords = shapely.get_coordinates(ring)
+            distances = np.concatenate(([0], np.cumsum(np.hypot(*np.diff(coords, axis=0).T))))
+            self.ring_vertices.append(coords[:-1])
+            self.ring_distances.append(distances[:-1])
+
+    def clamp(self, path):
+        """Constrain a path to the Polygon.
+
+        The path is expected to have at least some part inside the Polygon.
+
+        Description: https://gis.stackexchange.com/questions/428848/clamp-linestring-to-polygon
+        """
+
+        start = path[0]
+        end = path[-1]
+
+        # This splits the path at the points where it intersects with the polygon
+        # border and returns the pieces in the same order as the original path.
+        try:
+            split_path = ensure_geometry_collection(LineString(path).difference(self.boundary))
+        except FloatingPointError:
+            return _to_points(path)
+
+        if len(split_path.geoms) == 1:
+            # The path never intersects with the polygon, so it's entirely inside.
+            return _to_points(path)
+
+        # Add the start and end points to avoid losing part of the path if the
+        # start or end coincides with the polygon boundary
+        split_path = [ShapelyPoint(start), *split_path.geoms, ShapelyPoint(end)]
+        inside = shapely.contains(self.buffered_polygon, split_path)
+
+        last_point_inside = None
+        was_inside = False
+        result = []
+
+        for segment, segment_inside in zip(split_path, inside):
+            if not segment_inside:
+                was_inside = False
+                continue
+
+            coords = shapely.get_coordinates(segment)
+            distance = np.inf if last_point_inside is None else np.hypot(*(coords[0] - last_point_inside))
+
+            # The first part of this or condition checks whether we traveled
+            # outside the shape for a while.
+            #
+            # The second part of this or condition checks whether part of the
+            # path was removed by difference() above, because it coincided
+            # with part of the shape border.
+            if not was_inside or distance > 0.01:
+                if last_point_inside is not None and distance >= 0.02:
+                    # We traveled outside or on the border of the shape for
+                    # a while.  In either case, we need to add a path along the
+                    # border between the exiting and entering points.
+                    result.extend(self.border_path(last_point_inside, coords[0]))
+            else:
+                # this segment continues where the last one ended
+                coords = coords[1:]
 
+            result.extend(coords.tolist())
+            was_inside = True
+            last_point_inside = coords[-1] if len(coords) else last_point_inside
 
-def fix_starting_point(border_pieces):
-    """Reconnect the starting point of a polygon border's pieces.
+        return [Point(x, y) for x, y in result]
 
-    When splitting a polygon border with two lines, we want to get two
-    pieces.  However, that's not quite how Shapely works.  The outline
-    of the polygon is a LinearRing that starts and ends at the same place,
-    but Shapely still knows where that starting point is and splits there
-    too.
+    def border_path(self, exit_point, entry_point):
+        """Find the shorter way along the border from exit_point to entry_point.
 
-    We don't want that third piece, so we'll reconnect the segments that
-    touch the starting point.
-    """
+        Both points are projected onto the closest ring of the polygon.  The
+        ring's vertices between the two projections are returned, in the
+        direction that has the shorter arc length.
 
-    if len(border_pieces) == 3:
-        # Fortunately, Shapely keeps the starting point of the LinearRing
-        # as the starting point of the first segment.  That means it's also
-        # the ending point of the last segment.  Reconnecting is super simple:
-        return [border_pieces[1],
-                LineString(border_pieces[2].coords[:] + border_pieces[0].coords[1:])]
-    else:
-        # We probably cut exactly at the starting point.
-        return border_pieces
+        The exit and entry points themselves are not repeated.  Earlier
+        versions added points about 0.01 away from them, which became
+        near-duplicate stitches.
+        """
 
+        ring_index = self.ring_tree.query_nearest(ShapelyPoint(exit_point))[0]
+        ring = self.rings[ring_index]
+        vertices = self.ring_vertices[ring_index]
+        distances = self.ring_distances[ring_index]
+        length = ring.length
 
-def adjust_line_end(line, end):
-    """Reverse line if necessary to ensure that it ends near end."""
+        exit_distance, entry_distance = shapely.line_locate_point(ring, shapely.points([exit_point, entry_point]))
+        forward = (entry_distance - exit_distance) % length
 
-    line_start = ShapelyPoint(*line.coords[0])
-    line_end = ShapelyPoint(*line.coords[-1])
+        if forward <= length - forward:
+            along = (distances - exit_distance) % length
+            travel = forward
+        else:
+            along = (exit_distance - distances) % length
+            travel = length - forward
 
-    if line_end.distance(end) < line_start.distance(end):
-        return line
-    else:
-        return LineString(line.coords[::-1])
+        on_the_way = np.flatnonzero((along > 1e-9) & (along < travel - 1e-9))
+        return vertices[on_the_way[np.argsort(along[on_the_way], kind='stable')]].tolist()
 
 
-def find_border(polygon, point):
-    """Finds subpath of polygon which intersects with the point.
-       Ignores small border fragments"""
-    for border in polygon.interiors:
-        if border.length > 0.1 and border.intersects(point):
-            return border
-    else:
-        return polygon.exterior
+@lru_cache(maxsize=8)
+def get_polygon_clamper(polygon):
+    return PolygonClamper(polygon)
 
 
 def clamp_path_to_polygon(path, polygon):
     """Constrain a path to a Polygon.
 
-    The path is expected to have at least some part inside the Polygon.
-
-    Description: https://gis.stackexchange.com/questions/428848/clamp-linestring-to-polygon
+    The path may be a list of Points or an array of coordinates.  The
+    result is always a list of Points.
     """
 
-    start = path[0]
-    end = path[-1]
-
-    # This splits the path at the points where it intersects with the polygon
-    # border and returns the pieces in the same order as the original path.
-    try:
-        split_path = ensure_geometry_collection(LineString(path).difference(polygon.boundary))
-    except FloatingPointError:
-        return path
-
-    if len(split_path.geoms) == 1:
-        # The path never intersects with the polygon, so it's entirely inside.
-        return path
-
-    # Add the start and end points to avoid losing part of the path if the
-    # start or end coincides with the polygon boundary
-    split_path = [ShapelyPoint(start), *split_path.geoms, ShapelyPoint(end)]
+    return get_polygon_clamper(polygon).clamp(path)
 
-    # contains() checks can fail without the buffer.
-    buffered_polygon = prep(polygon.buffer(1e-9))
-
-    last_point_inside = None
-    was_inside = False
-    result = []
-
-    for segment in split_path:
-        if buffered_polygon.contains(segment):
-            start = ShapelyPoint(segment.coords[0])
-
-            # The first part of this or condition checks whether we traveled
-            # outside the shape for a while.
-            #
-            # The second part of this or condition checks whether part of the
-            # path was removed by difference() above, because it coincided
-            # with part of the shape border.
-            if not was_inside or last_point_inside.distance(start) > 0.01:
-                if last_point_inside is not None:
-                    # We traveled outside or on the border of the shape for
-                    # a while.  In either case, we need to add a path along the
-                    # border between the exiting and entering points.
-
-                    # First, find the two points.  Buffer them just a bit to
-                    # ensure intersection with the border.
-                    exit_point = last_point_inside.buffer(0.01, resolution=1)
-                    entry_point = ShapelyPoint(segment.coords[0]).buffer(0.01, resolution=1)
-
-                    if not exit_point.intersects(entry_point):
-                        # Now break the border into pieces using those points.
-                        border = find_border(polygon, exit_point)
-                        border_pieces = border.difference(MultiPolygon((entry_point, exit_point))).geoms
-                        border_pieces = fix_starting_point(border_pieces)
-
-                        # Pick the shortest way to get from the exiting to the
-                        # entering point along the border.
-                        shorter = min(border_pieces, key=lambda piece: piece.length)
-
-                        # We don't know which direction the polygon border
-                        # piece should be.  adjust_line_end() will figure
-                        # that out.
-                        result.append(adjust_line_end(shorter, entry_point))
-
-            result.append(segment)
-            was_inside = True
-            last_point_inside = ShapelyPoint(segment.coords[-1])
-        else:
-            was_inside = False
 
-    return segments_to_path(result)
+def _to_points(path):
+    if isinstance(path, np.ndarray):
+        return [Point(x, y) for x, y in path.tolist()]
+    return path
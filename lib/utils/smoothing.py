@@ -1,8 +1,6 @@
-import numpy as np
-from scipy.interpolate import splprep, splev
+from functools import lru_cache
 
-from .geometry import Point, coordinate_list_to_point_list
-from ..stitches.running_stitch import running_stitch
+import numpy as np
 
 
 def _remove_duplicate_coordinates(coords_array):
@@ -22,41 +20,111 @@ def _remove_duplicate_coordinates(coords_array):
     return coords_array[keepers]
 
 
-def smooth_path(path, smoothness=1.0):
+def _path_to_array(path):
+    """Convert an iterable of coordinate tuples or Points to an (N, 2) numpy.array."""
+    if isinstance(path, np.ndarray):
+        return path.astype(float).reshape((-1, 2))
+
+    return np.array([(point[0], point[1]) for point in path], dtype=float).reshape((-1, 2))
+
+
+def _resample_path(coords, spacing):
+    """Resample a path so that its segments are of similar length.
+
+    Corners sharper than 45 degrees are kept as they are and every part of the
+    path between two corners is divided into pieces of equal length no longer
+    than spacing.  This is the same corner test that running_stitch uses.
+
+    Arguments:
+        coords -- numpy.array of coordinates without consecutive duplicates
+        spacing -- the maximum segment length
+
+    Returns:
+        a numpy.array of coordinates
+    """
+
+    segments = np.diff(coords, axis=0)
+    segment_lengths = np.linalg.norm(segments, axis=1)
+    distances = np.r_[0, np.cumsum(segment_lengths)]
+
+    # vectors of the segments before and after each inner point
+    before = segments[:-1]
+    after = segments[1:]
+    dot_products = np.sum(before * after, axis=1)
+    squared_lengths = segment_lengths[:-1] ** 2 * segment_lengths[1:] ** 2
+    is_corner = dot_products * np.abs(dot_products) <= 0.5 * squared_lengths
+    corner_indices = np.r_[0, np.flatnonzero(is_corner) + 1, len(coords) - 1]
+
+    # Divide the path between each pair of corners evenly.
+    piece_starts = distances[corner_indices[:-1]]
+    piece_lengths = np.diff(distances[corner_indices])
+    piece_counts = np.maximum(np.ceil(piece_lengths / spacing), 1).astype(int)
+    steps = np.repeat(piece_lengths / piece_counts, piece_counts)
+    step_numbers = np.arange(piece_counts.sum()) - np.repeat(np.cumsum(piece_counts) - piece_counts, piece_counts)
+    sample_distances = np.r_[np.repeat(piece_starts, piece_counts) + step_numbers * steps, distances[-1]]
+
+    return np.column_stack((np.interp(sample_distances, distances, coords[:, 0]),
+                            np.interp(sample_distances, distances, coords[:, 1])))
+
+
+def smooth_path(path, smoothness=1.0, use_cache=False):
     """Smooth a path of coordinates.
 
     Arguments:
-        path -- an iterable of coordinate tuples or Points
+        path -- an iterable of coordinate tuples or Points, or a numpy.array
         smoothness -- float, how much smoothing to apply.  Bigger numbers
             smooth more.
+        use_cache -- if True, remember the result for this path and smoothness.
+            This helps when the same path is smoothed again, for example while
+            the user changes unrelated parameters in the params dialog.
 
     Returns:
-        A list of Points.
+        A numpy.array of coordinates with shape (N, 2).
     """
-    from ..debug import debug
+
+    coords = _path_to_array(path)
 
     if smoothness == 0:
         # s of exactly zero seems to indicate a default level of smoothing
         # in splprep, so we'll just exit instead.
-        return path
+        return coords
+
+    if use_cache:
+        # the cached array is shared, so callers must not modify it
+        return _smooth_path_cached(coords.tobytes(), smoothness)
+    else:
+        return _smooth_path(coords, smoothness)
+
+
+@lru_cache(maxsize=16)
+def _smooth_path_cached(coords_bytes, smoothness):
+    coords = np.frombuffer(coords_bytes, dtype=float).reshape((-1, 2))
+    smoothed = _smooth_path(coords, smoothness)
+    smoothed.flags.writeable = False
+
+    return smoothed
+
+
+def _smooth_path(coords, smoothness):
+    from ..debug import debug
+
+    # splprep blows up on duplicated consecutive points with "Invalid inputs"
+    coords = _remove_duplicate_coordinates(coords)
+
+    if len(coords) < 2:
+        return coords
 
     # Smoothing seems to look nicer if the line segments in the path are mostly
     # similar in length.  If we have some especially long segments, then the
     # smoothed path sometimes diverges more from the original path as the
     # spline curve struggles to fit the path.  This can be especially bad at
     # the start and end.
-    #
-    # Fortunately, we can convert the path to segments that are mostly the same
-    # length by using the running stitch algorithm.
-    path = running_stitch(coordinate_list_to_point_list(path), 5 * smoothness, smoothness / 2)
-
-    # splprep blows up on duplicated consecutive points with "Invalid inputs"
-    coords = _remove_duplicate_coordinates(np.array(path))
+    coords = _resample_path(coords, 5 * smoothness)
     num_points = len(coords)
 
     if num_points <= 3:
         # splprep throws an error unless num_points > k
-        return path
+        return coords
 
     # s is explained in this issue: https://github.com/scipy/scipy/issues/11916
     # the smoothness parameter limits how much the smoothed path can deviate
@@ -66,17 +134,20 @@ def smooth_path(path, smoothness=1.0):
     # up to 1mm away from the original path.
     s = num_points * (smoothness ** 2)
 
+    # scipy.interpolate takes a long time to import, and most extensions
+    # never smooth a path.
+    from scipy.interpolate import splev, splprep
+
     # .T transposes the array (for some reason splprep expects
     # [[x1, x2, ...], [y1, y2, ...]]
     tck, fp, ier, msg = splprep(coords.T, s=s, k=3, nest=-1, full_output=1)
     if ier > 0:
         debug.log(f"error {ier} smoothing path: {msg}")
-        return path
+        return coords
 
     # Evaluate the spline curve at many points along its length to produce the
     # smoothed point list.  2 * num_points seems to be a good number, but it
     # does produce a lot of points.
     smoothed_x_values, smoothed_y_values = splev(np.linspace(0, 1, int(num_points * 2)), tck[0])
-    coords = np.array([smoothed_x_values, smoothed_y_values]).T
 
-    return [Point(x, y) for x, y in coords]
+    return np.column_stack((smoothed_x_values, smoothed_y_values))